@@ -4,13 +4,15 @@ Provides individual and bulk download buttons for the labeling package.
 Uses @st.dialog modals to warn about incomplete labeling before download.
 """
 
+import html
 import streamlit as st
-import pandas as pd
 import config
 from i18n import t
+from services import session_manager as sm
 from services.export_service import (
+    cached_export,
     export_single_image,
-    export_full_session,
+    get_full_session_export,
     get_session_summary,
     export_huggingface_csv,
     export_jsonl,
@@ -19,22 +21,66 @@ from services.export_service import (
 
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
+_CHECK_MARK = {True: "✅", False: "❌"}
+
+# Rows shown in the bulk-incomplete dialog before "show all" is toggled
+_DIALOG_PREVIEW_ROWS = 100
+
+
 def _get_image_missing_info(img: dict) -> list[str]:
     """Return a list of human-readable items that are missing for one image."""
     missing = []
-    if img.get("label") is None:
-        missing.append(t("missing_categorical"))
-    elif img["label"] == "Cataract":
-        locs = img.get("locs_data", {})
-        for field in config.LOCS_FIELDS:
-            fid = field["field_id"]
-            if fid not in locs:
-                missing.append(t("missing_locs", field=field["label"]))
-    if not img.get("transcription"):
-        missing.append(t("missing_voice"))
+    for item in sm.get_missing_items(img):
+        if item == "categorical":
+            missing.append(t("missing_categorical"))
+        elif item == "voice":
+            missing.append(t("missing_voice"))
+        else:
+            missing.append(t("missing_locs", field=config.LOCS_FIELDS_BY_ID[item]["label"]))
     return missing
 
 
+def _html_table(columns, rows) -> str:
+    """Render a small fixed-shape table as HTML (no DataFrame round-trip)."""
+    parts = ["<table style='width:100%'><thead><tr>"]
+    parts.extend(f"<th>{html.escape(col)}</th>" for col in columns)
+    parts.append("</tr></thead><tbody>")
+    for row in rows:
+        parts.append("<tr><td>")
+        parts.append("</td><td>".join(html.escape(cell) for cell in row))
+        parts.append("</td></tr>")
+    parts.append("</tbody></table>")
+    return "".join(parts)
+
+
+def _deferred_download_button(exporter, label: str, mime: str, key: str) -> bool:
+    """Two-stage download: a plain button first, the real file after a rerun.
+
+    The export only runs once the doctor asked for it (and is then served
+    from cached_export).  Returns True when the file was downloaded.
+    """
+    flag = f"_materialize_{key}"
+    if not st.session_state.get(flag):
+        if st.button(label, key=f"{key}_prepare", use_container_width=True):
+            st.session_state[flag] = True
+            st.rerun()
+        return False
+
+    data, file_name = cached_export(exporter)
+    downloaded = st.download_button(
+        label=label,
+        data=data,
+        file_name=file_name,
+        mime=mime,
+        key=key,
+        use_container_width=True,
+    )
+    if downloaded:
+        # Back to the lightweight button: later reruns skip the export
+        st.session_state.pop(flag, None)
+    return downloaded
+
+
 # ── Dialog: individual download with incomplete labeling ─────────────────────
 
 def _show_single_incomplete_dialog(image_id: str):
@@ -95,43 +141,34 @@ def _show_bulk_incomplete_dialog():
         images = st.session_state.images
         order = st.session_state.image_order
 
-        # Build table data
+        not_required = t("locs_not_required")
         rows = []
         for img_id in order:
             img = images[img_id]
-            has_categorical = img.get("label") is not None
-            needs_locs = img.get("label") == "Cataract"
-            locs = img.get("locs_data", {})
-
-            if needs_locs:
-                locs_filled = all(
-                    f["field_id"] in locs for f in config.LOCS_FIELDS
-                )
-            else:
-                locs_filled = True  # Not applicable
-
-            has_voice = bool(img.get("transcription"))
+            # Only show images that have something missing
+            if not sm.is_image_incomplete(img):
+                continue
+            label = img.get("label")
 
             # Determine LOCS III column value:
             #   - Cataract selected, all filled → ✅
             #   - Cataract selected, missing fields → ❌
             #   - No label selected → ❌
             #   - Non-cataract label selected → "Not Required"
-            if needs_locs:
-                locs_cell = "✅" if locs_filled else "❌"
-            elif has_categorical:
-                locs_cell = t("locs_not_required")
+            if label == "Cataract":
+                locs = img.get("locs_data", {})
+                locs_cell = _CHECK_MARK[all(fid in locs for fid in config.LOCS_FIELD_IDS)]
+            elif label is not None:
+                locs_cell = not_required
             else:
                 locs_cell = "❌"
 
-            # Only show images that have something missing
-            if not (has_categorical and locs_filled and has_voice):
-                rows.append({
-                    t("col_image"): img["filename"],
-                    t("col_categorical"): "✅" if has_categorical else "❌",
-                    t("col_locs"): locs_cell,
-                    t("col_voice"): "✅" if has_voice else "❌",
-                })
+            rows.append((
+                img["filename"],
+                _CHECK_MARK[label is not None],
+                locs_cell,
+                _CHECK_MARK[bool(img.get("transcription"))],
+            ))
 
         if not rows:
             st.session_state.pop("_pending_bulk_dl", None)
@@ -141,13 +178,20 @@ def _show_bulk_incomplete_dialog():
         st.markdown(
             t("bulk_incomplete_msg", count=len(rows))
         )
-        df = pd.DataFrame(rows)
-        st.dataframe(df, use_container_width=True, hide_index=True)
+        # Large sessions: only ship the first rows to the browser unless the
+        # doctor asks for the full list (an expander would still send it all).
+        if len(rows) > _DIALOG_PREVIEW_ROWS and not st.toggle(
+            t("show_all", count=len(rows)), key="_dlg_bulk_show_all",
+        ):
+            rows = rows[:_DIALOG_PREVIEW_ROWS]
+        columns = (t("col_image"), t("col_categorical"), t("col_locs"), t("col_voice"))
+        st.markdown(_html_table(columns, rows), unsafe_allow_html=True)
 
         st.divider()
         c1, c2 = st.columns(2)
         with c1:
-            zip_bytes, zip_name = export_full_session()
+            with st.spinner(t("preparing_zip")):
+                zip_bytes, zip_name = get_full_session_export()
             if st.download_button(
                 label=t("download_anyway"),
                 data=zip_bytes,
@@ -188,6 +232,9 @@ def render_downloader(image_id: str):
         _show_bulk_incomplete_dialog()
         return
 
+    # One summary per render, shared by the info panel and bulk section
+    summary = get_session_summary()
+
     # ── Two columns: Individual download (left) | Session info (right) ───
     col_dl, col_info = st.columns(2)
 
@@ -205,20 +252,31 @@ def render_downloader(image_id: str):
             ):
                 st.session_state["_pending_single_dl"] = image_id
                 st.rerun()
-        else:
+        elif st.session_state.get("_materialize_single") == image_id:
+            # ZIP is only built after the doctor asked for it (see below)
             zip_bytes, zip_name = export_single_image(image_id)
-            st.download_button(
+            if st.download_button(
                 label=t("download_file", filename=img['filename']),
                 data=zip_bytes,
                 file_name=zip_name,
                 mime="application/zip",
                 key=f"dl_single_{image_id}",
                 use_container_width=True,
-            )
+            ):
+                st.session_state.pop("_materialize_single", None)
+        else:
+            # Lightweight button: building the ZIP on every rerun is wasted
+            # work when the doctor is only browsing images.
+            if st.button(
+                t("prepare_download", filename=img['filename']),
+                key=f"dl_single_prepare_{image_id}",
+                use_container_width=True,
+            ):
+                st.session_state["_materialize_single"] = image_id
+                st.rerun()
 
     with col_info:
         st.subheader(t("session_info"))
-        summary = get_session_summary()
         sc1, sc2 = st.columns(2)
         with sc1:
             st.metric(t("images_metric"), summary["total"])
@@ -232,18 +290,11 @@ def render_downloader(image_id: str):
     # ── Full-width: Bulk download ────────────────────────────────────────
     st.subheader(t("bulk_download"))
 
-    summary = get_session_summary()
-
     if summary["total"] == 0:
         st.info(t("no_images_download"))
     else:
         # Check if any image has incomplete labeling
-        has_incomplete = any(
-            _get_image_missing_info(st.session_state.images[iid])
-            for iid in st.session_state.image_order
-        )
-
-        if has_incomplete:
+        if sm.has_incomplete_images():
             if st.button(
                 t("download_all_zip"),
                 key="dl_bulk_check",
@@ -253,7 +304,8 @@ def render_downloader(image_id: str):
                 st.session_state["_pending_bulk_dl"] = True
                 st.rerun()
         else:
-            zip_bytes, zip_name = export_full_session()
+            with st.spinner(t("preparing_zip")):
+                zip_bytes, zip_name = get_full_session_export()
             if st.download_button(
                 label=t("download_all_zip"),
                 data=zip_bytes,
@@ -270,24 +322,12 @@ def render_downloader(image_id: str):
         st.markdown(t("ml_formats"))
         ml1, ml2 = st.columns(2)
         with ml1:
-            csv_bytes, csv_name = export_huggingface_csv()
-            if st.download_button(
-                label=t("hf_csv"),
-                data=csv_bytes,
-                file_name=csv_name,
-                mime="text/csv",
-                key="dl_hf_csv",
-                use_container_width=True,
+            if _deferred_download_button(
+                export_huggingface_csv, t("hf_csv"), "text/csv", "dl_hf_csv",
             ):
                 st.session_state.session_downloaded = True
         with ml2:
-            jsonl_bytes, jsonl_name = export_jsonl()
-            if st.download_button(
-                label=t("jsonl_finetune"),
-                data=jsonl_bytes,
-                file_name=jsonl_name,
-                mime="application/jsonl",
-                key="dl_jsonl",
-                use_container_width=True,
+            if _deferred_download_button(
+                export_jsonl, t("jsonl_finetune"), "application/jsonl", "dl_jsonl",
             ):
                 st.session_state.session_downloaded = True
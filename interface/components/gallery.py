@@ -7,13 +7,29 @@ badges and click-to-select behaviour.
 import streamlit as st
 from i18n import t
 from services import session_manager as sm
+from utils import page_count
+
+
+THUMB_WIDTH = 120  # fixed thumbnail width in pixels
+
+# Selection highlight as CSS, injected once per render instead of inline
+# styles wrapped around every thumbnail.  Each thumbnail sits in a keyed
+# container, which Streamlit tags with an "st-key-<key>" class.
+_GALLERY_CSS = """
+<style>
+[class*="st-key-galthumb_"] {
+    border: 3px solid transparent;
+    border-radius: 8px;
+    padding: 2px;
+    text-align: center;
+}
+.st-key-galthumb_selected { border-color: #4CAF50; }
+</style>
+"""
 
 
-def _label_badge(label):
-    """Return a coloured status indicator for the label value."""
-    if label is None:
-        return "🔴"   # unlabeled
-    return "🟢"       # labeled (any value)
+# Status indicator keyed by "is unlabeled"
+_BADGE = {True: "🔴", False: "🟢"}
 
 
 def render_gallery():
@@ -35,53 +51,51 @@ def render_gallery():
     st.progress(labeled / total if total > 0 else 0)
 
     # ── Thumbnail strip ──────────────────────────────────────────────────
+    st.markdown(_GALLERY_CSS, unsafe_allow_html=True)
     # Show up to 8 thumbnails per row; wrap if there are more.
     COLS_PER_ROW = 6
-    THUMB_HEIGHT = 120  # fixed thumbnail height in pixels
     num_images = len(order)
 
     # Paginate the gallery if many images
     if "gallery_page" not in st.session_state:
         st.session_state.gallery_page = 0
 
-    total_pages = max(1, -(-num_images // COLS_PER_ROW))  # ceil division
-    page = st.session_state.gallery_page
+    total_pages = page_count(num_images, COLS_PER_ROW)
+    # Deleting images can leave the stored page past the end
+    page = min(st.session_state.gallery_page, total_pages - 1)
+    st.session_state.gallery_page = page
     start = page * COLS_PER_ROW
-    end = min(start + COLS_PER_ROW, num_images)
-    visible_ids = order[start:end]
+    visible_ids = order[start:start + COLS_PER_ROW]
 
     # Always use fixed number of columns so thumbnails keep consistent size
     cols = st.columns(COLS_PER_ROW)
 
-    clicked = False
     for i, img_id in enumerate(visible_ids):
-        img = images[img_id]
-        badge = _label_badge(img["label"])
-        is_selected = (img_id == current_id)
-
         with cols[i]:
-            # Visual border to highlight the selected thumbnail
-            border_color = "#4CAF50" if is_selected else "transparent"
-            st.markdown(
-                f"<div style='border:3px solid {border_color}; border-radius:8px; "
-                f"padding:2px; text-align:center;'>",
-                unsafe_allow_html=True,
-            )
-            st.image(img["bytes"], width=THUMB_HEIGHT)
-            st.markdown("</div>", unsafe_allow_html=True)
-
-            # Label + filename
-            short_name = img["filename"]
-            if len(short_name) > 18:
-                short_name = short_name[:15] + "…"
-
-            if st.button(
-                f"{badge} {short_name}",
-                key=f"thumb_{img_id}",
-                use_container_width=True,
-            ):
-                sm.set_current_image(img_id)
-                clicked = True
+            # st.image goes through the media file manager: the browser gets
+            # a cached URL, not the JPEG re-sent inline on every rerun
+            key = "galthumb_selected" if img_id == current_id else f"galthumb_{i}"
+            with st.container(key=key):
+                st.image(images[img_id]["thumb_bytes"], width=THUMB_WIDTH)
+
+    # A single selector widget for the row instead of one button per
+    # thumbnail.  No key: its identity follows `index`, so it resyncs when
+    # the image is changed elsewhere (navigation buttons, deletion).
+    selected = st.radio(
+        t("select_image"),
+        visible_ids,
+        index=visible_ids.index(current_id) if current_id in visible_ids else None,
+        format_func=lambda iid: "".join((
+            _BADGE[images[iid]["label"] is None], " ", images[iid]["short_name"],
+        )),
+        horizontal=True,
+        label_visibility="collapsed",
+    )
+
+    clicked = False
+    if selected is not None and selected != current_id:
+        sm.set_current_image(selected)
+        clicked = True
 
     # ── Gallery pagination ───────────────────────────────────────────────
     if total_pages > 1:
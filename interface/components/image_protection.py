@@ -19,10 +19,12 @@ Protection layers (defence-in-depth):
   4. JS:  contextmenu blocked on entire parent document.
   5. JS:  Ctrl+S / Ctrl+U / Ctrl+P / F12 / DevTools shortcuts blocked.
   6. JS:  dragstart blocked for images.
-  7. JS:  MutationObserver re-applies draggable=false to new images.
+  7. JS:  MutationObserver sets draggable=false on newly added images.
 """
 
+import re
 import streamlit as st
+from utils import minify_css
 
 # ── CSS via st.markdown ──────────────────────────────────────────────────────
 _PROTECTION_CSS = """
@@ -103,20 +105,26 @@ _PROTECTION_JS = """
     }, true);
 
     // ── Block keyboard shortcuts ────────────────────────────────────────
+    // Blocked shortcuts as canonical "ctrl+shift+key" strings: one Set
+    // lookup per keystroke.  Ctrl+Shift+S/U/P stay blocked like Ctrl+S/U/P.
+    var BLOCKED = new Set([
+        'ctrl+s', 'ctrl+shift+s',           // Save page
+        'ctrl+u', 'ctrl+shift+u',           // View source
+        'ctrl+p', 'ctrl+shift+p',           // Print
+        'ctrl+shift+i',                     // Inspector
+        'ctrl+shift+j',                     // Console
+        'ctrl+shift+c',                     // Picker
+        'f12'                               // DevTools
+    ]);
+
+    // Capture phase is kept on purpose: a focused widget that stops
+    // propagation must not let Ctrl+S / F12 through.
     doc.addEventListener('keydown', function (e) {
-        var dominated = false;
-        var ctrl = e.ctrlKey || e.metaKey;
-        var key  = e.key ? e.key.toLowerCase() : '';
-
-        if (ctrl && key === 's') dominated = true;   // Save page
-        if (ctrl && key === 'u') dominated = true;   // View source
-        if (ctrl && key === 'p') dominated = true;   // Print
-        if (e.keyCode === 123)   dominated = true;   // F12
-        if (ctrl && e.shiftKey && key === 'i') dominated = true;  // Inspector
-        if (ctrl && e.shiftKey && key === 'j') dominated = true;  // Console
-        if (ctrl && e.shiftKey && key === 'c') dominated = true;  // Picker
-
-        if (dominated) return block(e);
+        var k = e.keyCode === 123 ? 'f12'
+            : (e.ctrlKey || e.metaKey ? 'ctrl+' : '')
+              + (e.shiftKey ? 'shift+' : '')
+              + (e.key ? e.key.toLowerCase() : '');
+        if (BLOCKED.has(k)) return block(e);
     }, true);
 
     // ── Block drag-and-drop of images ───────────────────────────────────
@@ -125,23 +133,37 @@ _PROTECTION_JS = """
     }, true);
 
     // ── MutationObserver — lock new images as they appear ───────────────
+    // Drag and right-click are already handled by the delegated listeners
+    // above; only the draggable attribute has to be set per element.
     function lockImgs(root) {
-        var imgs = root.querySelectorAll ? root.querySelectorAll('img') : [];
-        for (var i = 0; i < imgs.length; i++) {
-            imgs[i].setAttribute('draggable', 'false');
-            imgs[i].ondragstart = function () { return false; };
-            imgs[i].oncontextmenu = function () { return false; };
+        if (root.tagName === 'IMG') {
+            root.setAttribute('draggable', 'false');
+            return;
         }
+        var imgs = root.querySelectorAll ? root.querySelectorAll('img') : [];
+        for (var i = 0; i < imgs.length; i++) imgs[i].setAttribute('draggable', 'false');
     }
     lockImgs(doc);
 
-    var timer = null;
-    new MutationObserver(function () {
-        if (timer) return;
-        timer = setTimeout(function () {
-            timer = null;
-            lockImgs(doc);
-        }, 250);
+    // Only newly inserted subtrees are scanned (childList only — attribute
+    // and text changes cannot introduce images), once per animation frame.
+    var pending = [];
+    var scheduled = false;
+    new MutationObserver(function (mutations) {
+        for (var i = 0; i < mutations.length; i++) {
+            var added = mutations[i].addedNodes;
+            for (var j = 0; j < added.length; j++) {
+                if (added[j].nodeType === 1) pending.push(added[j]);
+            }
+        }
+        if (scheduled || !pending.length) return;
+        scheduled = true;
+        requestAnimationFrame(function () {
+            scheduled = false;
+            var nodes = pending;
+            pending = [];
+            for (var k = 0; k < nodes.length; k++) lockImgs(nodes[k]);
+        });
     }).observe(doc.body, { childList: true, subtree: true });
 
 })();
@@ -149,6 +171,29 @@ _PROTECTION_JS = """
 """
 
 
+# ── Minified payloads (computed once at import) ──────────────────────────────
+# The readable sources above are kept for maintenance; what is sent to the
+# browser on every rerun is the minified form.
+
+def _minify_js(js: str) -> str:
+    """Drop // comments and indentation, keeping one statement per line.
+
+    Line breaks are preserved so automatic semicolon insertion still works;
+    a comment must be preceded by whitespace, so "//" inside a string or URL
+    is left alone.
+    """
+    lines = []
+    for line in js.splitlines():
+        line = re.sub(r"(^|\s)//.*$", "", line).strip()
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+_PROTECTION_CSS_MIN = minify_css(_PROTECTION_CSS)
+_PROTECTION_JS_MIN = _minify_js(_PROTECTION_JS)
+
+
 def inject_image_protection():
     """Inject CSS + JS image-protection layers into the page.
 
@@ -158,7 +203,9 @@ def inject_image_protection():
     - The CSS also hides st.html wrappers to prevent layout shifts.
     """
     # 1) CSS protection + hide st.html wrappers
-    st.markdown(_PROTECTION_CSS, unsafe_allow_html=True)
+    st.markdown(_PROTECTION_CSS_MIN, unsafe_allow_html=True)
 
     # 2) JS protection (right-click, keyboard shortcuts, drag, observer)
-    st.html(_PROTECTION_JS)
+    # Re-emitted every rerun like the CSS: an element a rerun does not
+    # render is removed, and with its iframe go the listeners it installed.
+    st.html(_PROTECTION_JS_MIN)
@@ -6,85 +6,99 @@ Provides:
      - Nuclear Opalescence (NO) 0-6
      - Nuclear Color (NC)       0-6
      - Cortical Opacity (C)     0-5
-  3. Auto-saves (upsert) to audit DB on every change.
+  3. Auto-saves (upsert) to audit DB on every change, via the session's
+     write-behind queue (flushed every few seconds by main.py).
+
+Runs as a fragment: label/LOCS clicks only rerun this panel.  A full app
+rerun is requested only when session counters change (gallery badges,
+progress and download state depend on them).
 
 Numeric values are stored for ML; only text labels are shown in the UI.
 """
 
+import functools
 import streamlit as st
 import config
-import database as db
-from i18n import t, label_display, label_from_display, locs_display
+from i18n import t, label_display, locs_display, DEFAULT_LANGUAGE
 from services import session_manager as sm
 
 
-def _save_to_db(img: dict, image_id: str):
-    """Persist current label + LOCS data to audit DB (non-blocking)."""
-    try:
-        db.save_or_update_annotation(
-            image_filename=img["filename"],
-            label=img["label"],
-            transcription=img.get("transcription", ""),
-            doctor_name=st.session_state.get("doctor_name", ""),
-            session_id=st.session_state.get("session_id", ""),
-            locs_data=img.get("locs_data", {}),
-        )
-    except Exception:
-        pass
+_LABEL_INDEX = {opt["display"]: i for i, opt in enumerate(config.LABEL_OPTIONS)}
+# {field_id: {stored value: dropdown index}}
+_LOCS_VALUE_INDEX = {
+    f["field_id"]: {opt["value"]: i for i, opt in enumerate(f["options"])}
+    for f in config.LOCS_FIELDS
+}
+
+
+# Translations only depend on the UI language, so they are built once per
+# language instead of on every rerun.  *lang* must be the active language:
+# the i18n helpers read it from the session.
+
+@functools.lru_cache(maxsize=None)
+def _label_options(lang: str) -> tuple[tuple[str, ...], dict[str, str]]:
+    """Return (translated radio options, translated → English label map)."""
+    to_english = {
+        label_display(opt["display"]): opt["display"]
+        for opt in config.LABEL_OPTIONS
+    }
+    return tuple(to_english), to_english
+
+
+@functools.lru_cache(maxsize=None)
+def _locs_options(lang: str, field_id: str) -> tuple[str, tuple[str, ...], dict[str, int]]:
+    """Return (field label, option labels, option label → value) for a LOCS field."""
+    field = config.LOCS_FIELDS_BY_ID[field_id]
+    to_value = {
+        locs_display(opt["display"]): opt["value"] for opt in field["options"]
+    }
+    return locs_display(field["label"]), tuple(to_value), to_value
 
 
-def _render_locs_dropdown(field: dict, image_id: str, current_locs: dict) -> int | None:
+def _render_locs_dropdown(field: dict, image_id: str, current_locs: dict,
+                          lang: str) -> int | None:
     """Render a single LOCS dropdown and return the selected numeric value."""
     field_id = field["field_id"]
-    options = field["options"]
-    display_labels = [locs_display(opt["display"]) for opt in options]
+    field_label, display_labels, to_value = _locs_options(lang, field_id)
 
     # Determine current index from stored data
-    stored_value = current_locs.get(field_id)
-    if stored_value is not None:
-        current_index = next(
-            (i for i, opt in enumerate(options) if opt["value"] == stored_value),
-            None,
-        )
-    else:
-        current_index = None
+    current_index = _LOCS_VALUE_INDEX[field_id].get(current_locs.get(field_id))
 
     # Use index=None so nothing is pre-selected until doctor chooses
     selected_display = st.selectbox(
-        locs_display(field["label"]),
+        field_label,
         display_labels,
         index=current_index,
         key=f"locs_{field_id}_{image_id}",
         placeholder=t("locs_placeholder"),
     )
 
-    if selected_display is not None and selected_display in display_labels:
-        idx = display_labels.index(selected_display)
-        return options[idx]["value"]
-    return None
+    return to_value.get(selected_display)
 
 
+@st.fragment
 def render_labeler(image_id: str):
     """Render the full labeling panel for the given image."""
-    img = st.session_state.images.get(image_id)
+    # Read session state once; everything below works on plain locals.
+    state = st.session_state
+    img = state.images.get(image_id)
     if img is None:
         return
 
+    doctor = state.get("doctor_name", "")
+    session_id = state.get("session_id", "")
+    lang = state.get("ui_language", DEFAULT_LANGUAGE)
+
     st.subheader(t("labeling"))
 
     # ── 1. Categorical classification ────────────────────────────────────
     # Translated display (UI only); storage always uses English name.
-    translated_options = [label_display(opt["display"]) for opt in config.LABEL_OPTIONS]
+    translated_options, to_english = _label_options(lang)
     current_label = img.get("label")  # English, e.g. "Cataract"
 
-    if current_label is not None:
-        translated_current = label_display(current_label)
-        if translated_current in translated_options:
-            current_index = translated_options.index(translated_current)
-        else:
-            current_index = None
-    else:
-        current_index = None
+    # Options keep config order in every language, so the English name
+    # maps straight to the radio index.
+    current_index = _LABEL_INDEX.get(current_label)
 
     with st.container(border=True):
         if current_index is None:
@@ -100,18 +114,20 @@ def render_labeler(image_id: str):
         )
 
     # Map translated selection back to English for storage
-    new_label = label_from_display(selected) if selected in translated_options else None
+    new_label = to_english.get(selected)
 
     # Detect categorical change
     label_changed = new_label is not None and new_label != current_label
+    locs_changed = False
+    counters_changed = False
     if label_changed:
         img["label"] = new_label
-        img["labeled_by"] = st.session_state.get("doctor_name", "")
+        img["labeled_by"] = doctor
         # If switching away from Cataract, clear LOCS data
         if new_label != "Cataract":
             img["locs_data"] = {}
+        counters_changed = sm.sync_image_counters(image_id)
         sm.update_activity()
-        _save_to_db(img, image_id)
 
     # ── 2. LOCS III Classification (only for "Cataract") ─────────────────
     effective_label = new_label or current_label
@@ -120,11 +136,10 @@ def render_labeler(image_id: str):
         st.markdown(t("locs_title"))
 
         current_locs = img.get("locs_data", {})
-        locs_changed = False
 
         with st.container(border=True):
             for field_def in config.LOCS_FIELDS:
-                value = _render_locs_dropdown(field_def, image_id, current_locs)
+                value = _render_locs_dropdown(field_def, image_id, current_locs, lang)
                 field_id = field_def["field_id"]
                 if value is not None and value != current_locs.get(field_id):
                     current_locs[field_id] = value
@@ -133,8 +148,8 @@ def render_labeler(image_id: str):
         img["locs_data"] = current_locs
 
         if locs_changed:
+            counters_changed |= sm.sync_image_counters(image_id)
             sm.update_activity()
-            _save_to_db(img, image_id)
 
         # LOCS summary
         filled = sum(1 for f in config.LOCS_FIELDS if f["field_id"] in current_locs)
@@ -144,6 +159,23 @@ def render_labeler(image_id: str):
         else:
             st.success(t("locs_complete", filled=filled, total=total_fields))
 
+    # ── Persist: one queued upsert per rerun, skipped if nothing changed ──
+    if label_changed or locs_changed:
+        payload_hash = hash((
+            img["label"],
+            tuple(sorted(img.get("locs_data", {}).items())),
+            img.get("transcription", ""),
+        ))
+        if img.get("_last_saved_hash") != payload_hash:
+            sm.queue_annotation_save(img, image_id, doctor, session_id)
+            img["_last_saved_hash"] = payload_hash
+            # A fragment rerun never reaches main.py's end-of-run flush
+            sm.flush_annotation_saves()
+
+    # Labeled/complete status flipped: refresh the rest of the page too
+    if counters_changed:
+        st.rerun(scope="app")
+
     # ── 3. Visual feedback ───────────────────────────────────────────────────
     if effective_label is None:
         st.warning(t("unlabeled"))
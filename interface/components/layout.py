@@ -0,0 +1,48 @@
+"""OphthalmoCapture — Page Layout Fixes
+
+Prevents horizontal layout shift from the scrollbar appearing/disappearing.
+HF Spaces renders Streamlit inside an iframe. The scroll container is NOT
+<html> but internal Streamlit elements. We target every possible scroll
+container and use scrollbar-gutter:stable (modern) + overflow-y:scroll (fallback).
+"""
+
+import streamlit as st
+from utils import minify_css
+
+_LAYOUT_CSS = """
+<style>
+    /* Modern solution: reserves space for scrollbar even when not needed */
+    html,
+    body,
+    [data-testid="stAppViewContainer"],
+    [data-testid="stMain"],
+    .main,
+    section[data-testid="stMain"],
+    [data-testid="stVerticalBlockBorderWrapper"],
+    .stMainBlockContainer {
+        scrollbar-gutter: stable !important;
+    }
+
+    /* Fallback: force scrollbar always visible on all potential containers */
+    [data-testid="stAppViewContainer"],
+    [data-testid="stMain"],
+    section.main {
+        overflow-y: scroll !important;
+    }
+
+    /* Prevent any horizontal overflow that could cause shifts */
+    [data-testid="stMainBlockContainer"],
+    [data-testid="stVerticalBlock"] {
+        overflow-x: hidden !important;
+    }
+</style>
+"""
+
+# Sent on every rerun (Streamlit drops elements a rerun doesn't re-emit),
+# so it is minified once here rather than rebuilt inside main.py's script.
+_LAYOUT_CSS_MIN = minify_css(_LAYOUT_CSS)
+
+
+def inject_layout_fix():
+    """Emit the scrollbar/overflow CSS for this run."""
+    st.markdown(_LAYOUT_CSS_MIN, unsafe_allow_html=True)
@@ -4,12 +4,24 @@ Records audio via st.audio_input, transcribes with Whisper, stores the
 audio bytes and transcription in the ephemeral session, and lets the
 doctor edit the transcription or restore the original.
 
+Whisper runs on a background thread; a small polling fragment triggers a
+rerun once the result is ready, so the rest of the UI stays responsive
+while a recording is being transcribed.
+
 Includes timestamped segments from Whisper for reference.
 """
 
-import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
 import streamlit as st
-import database as db
+
+# xxh3 is an order of magnitude faster than md5 on multi-MB WAV blobs;
+# fall back to md5 if xxhash is not installed.
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
 from i18n import t
 from services import session_manager as sm
 from services.whisper_service import transcribe_audio_with_timestamps, format_timestamp
@@ -17,10 +29,114 @@ from services.whisper_service import transcribe_audio_with_timestamps, format_ti
 
 def _audio_fingerprint(audio_bytes: bytes) -> str:
     """Return a short hash of the audio content for change detection."""
+    if XXHASH_AVAILABLE:
+        # Length as seed so same-hash blobs of different sizes still differ
+        return xxhash.xxh3_64(audio_bytes, seed=len(audio_bytes)).hexdigest()
+    import hashlib  # only needed for the fallback
     return hashlib.md5(audio_bytes).hexdigest()
 
 
-def render_recorder(image_id: str, model, language: str):
+def _get_or_cache_fingerprint(image_id: str, audio_wav) -> str:
+    """Fingerprint of the recording, hashed only when a new one arrives.
+
+    st.audio_input builds a fresh UploadedFile object on every rerun, but
+    its file_id (and size) only change with a new recording, so those key
+    the memo instead of id().
+    """
+    cache_key = f"_fp_cache_{image_id}"
+    ident = (getattr(audio_wav, "file_id", None), audio_wav.size)
+    cached = st.session_state.get(cache_key)
+    if cached is not None and ident[0] is not None and cached[0] == ident:
+        return cached[1]
+    fingerprint = _audio_fingerprint(audio_wav.getvalue())
+    st.session_state[cache_key] = (ident, fingerprint)
+    return fingerprint
+
+
+@st.cache_resource(show_spinner=False)
+def _transcription_executor() -> ThreadPoolExecutor:
+    """Process-wide worker pool for Whisper (bounded: models are large)."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="whisper")
+
+
+def _apply_finished_transcriptions():
+    """Move finished background transcriptions into their images.
+
+    Called before any widget is created (like the button flags), so the
+    text_area state can still be updated.  Covers every image, not only
+    the one on screen, in case the doctor moved on while Whisper ran.
+    """
+    pending = st.session_state.get("_pending_transcriptions")
+    if not pending:
+        return
+    memo = st.session_state.setdefault("_transcript_memo", {})
+    for image_id, (future, audio_bytes, memo_key) in list(pending.items()):
+        if not future.done():
+            continue
+        del pending[image_id]
+
+        try:
+            text, segments = future.result()
+            memo[memo_key] = (text, tuple(dict(seg) for seg in segments))
+        except Exception as e:
+            st.error(t("transcription_error", error=e))
+            # Not processed after all: the same recording is retried
+            st.session_state.pop(f"_last_audio_{image_id}", None)
+            continue
+
+        img = st.session_state.images.get(image_id)
+        if img is None:
+            continue
+
+        # Store in session (memo_key starts with the content fingerprint)
+        img["audio_bytes"] = audio_bytes
+        img["audio_fingerprint"] = memo_key[0]
+
+        # Append (don't overwrite) if there was previous text
+        if img["transcription"]:
+            img["transcription"] += " " + text
+        else:
+            img["transcription"] = text
+
+        # Keep a copy of the raw Whisper output
+        if img["transcription_original"]:
+            img["transcription_original"] += " " + text
+        else:
+            img["transcription_original"] = text
+
+        # Store timestamped segments, with their MM:SS labels formatted once
+        for seg in segments:
+            seg["_ts_start"] = format_timestamp(seg["start"])
+            seg["_ts_end"] = format_timestamp(seg["end"])
+        segments_key = f"_segments_{image_id}"
+        existing_segments = st.session_state.get(segments_key, [])
+        st.session_state[segments_key] = existing_segments + segments
+
+        # Update the text_area widget state so it reflects the new text
+        st.session_state[f"transcription_area_{image_id}"] = img["transcription"]
+
+        # Re-save to audit DB if the image is already labeled (queued upsert)
+        if img.get("label"):
+            sm.queue_annotation_save(
+                img, image_id,
+                st.session_state.get("doctor_name", ""),
+                st.session_state.get("session_id", ""),
+            )
+
+        sm.sync_image_counters(image_id)
+        sm.update_activity()
+
+
+@st.fragment(run_every="1s")
+def _render_transcription_progress(image_id: str):
+    """Show progress while Whisper runs; rerun the page when it finishes."""
+    entry = st.session_state.get("_pending_transcriptions", {}).get(image_id)
+    if entry is None or entry[0].done():
+        st.rerun(scope="app")
+    st.caption(f"⏳ {t('transcribing')}")
+
+
+def render_recorder(image_id: str, model, language: str, model_size: str):
     """Render the audio recording + transcription panel.
 
     Parameters
@@ -31,6 +147,8 @@ def render_recorder(image_id: str, model, language: str):
         Loaded Whisper model instance.
     language : str
         ISO language code for transcription (e.g. "es").
+    model_size : str
+        Name *model* was loaded by; identifies it in the transcript memo.
     """
     img = st.session_state.images.get(image_id)
     if img is None:
@@ -51,21 +169,30 @@ def render_recorder(image_id: str, model, language: str):
 
     if st.session_state.pop(_rerecord_flag, False):
         img["audio_bytes"] = None
+        img["audio_fingerprint"] = None
         img["transcription"] = ""
         img["transcription_original"] = ""
         st.session_state.pop(segments_key, None)
         st.session_state.pop(processed_key, None)
+        st.session_state.pop(f"_fp_cache_{image_id}", None)
+        pending = st.session_state.get("_pending_transcriptions", {}).pop(image_id, None)
+        if pending is not None:
+            pending[0].cancel()
         st.session_state.pop(f"audio_input_{image_id}", None)
         # Set value BEFORE the text_area is created
         st.session_state[f"transcription_area_{image_id}"] = ""
+        sm.sync_image_counters(image_id)
         sm.update_activity()
 
     if st.session_state.pop(_restore_flag, False):
         img["transcription"] = img["transcription_original"]
         # Set value BEFORE the text_area is created
         st.session_state[f"transcription_area_{image_id}"] = img["transcription_original"]
+        sm.sync_image_counters(image_id)
         sm.update_activity()
 
+    _apply_finished_transcriptions()
+
     # ── Audio recording ──────────────────────────────────────────────────
     audio_wav = st.audio_input(
         t("record_audio"),
@@ -73,56 +200,34 @@ def render_recorder(image_id: str, model, language: str):
     )
 
     if audio_wav is not None:
-        audio_bytes = audio_wav.getvalue()
-        fingerprint = _audio_fingerprint(audio_bytes)
+        fingerprint = _get_or_cache_fingerprint(image_id, audio_wav)
 
         # Only transcribe if this is a *new* recording (content changed)
         if st.session_state.get(processed_key) != fingerprint:
-            with st.spinner(t("transcribing")):
-                text, segments = transcribe_audio_with_timestamps(
-                    model, audio_bytes, language
-                )
-
-            # Store in session
-            img["audio_bytes"] = audio_bytes
-
-            # Append (don't overwrite) if there was previous text
-            if img["transcription"]:
-                img["transcription"] += " " + text
+            audio_bytes = audio_wav.getvalue()
+            # Same recording, model and language already transcribed in this
+            # session (kept in session state only — never on disk)
+            memo_key = (fingerprint, model_size, language)
+            cached = st.session_state.get("_transcript_memo", {}).get(memo_key)
+            if cached is not None:
+                future = Future()
+                future.set_result((cached[0], [dict(seg) for seg in cached[1]]))
             else:
-                img["transcription"] = text
-
-            # Keep a copy of the raw Whisper output
-            if img["transcription_original"]:
-                img["transcription_original"] += " " + text
-            else:
-                img["transcription_original"] = text
-
-            # Store timestamped segments
-            existing_segments = st.session_state.get(segments_key, [])
-            st.session_state[segments_key] = existing_segments + segments
-
+                future = _transcription_executor().submit(
+                    transcribe_audio_with_timestamps,
+                    model, audio_bytes, language, raise_errors=True,
+                )
+            st.session_state.setdefault("_pending_transcriptions", {})[image_id] = (
+                future, audio_bytes, memo_key,
+            )
+            if cached is not None:
+                # Still before the text_area: apply now, no polling rerun
+                _apply_finished_transcriptions()
             # Mark this audio as processed using content hash (stable across reruns)
             st.session_state[processed_key] = fingerprint
-            # Update the text_area widget state so it reflects the new text
-            st.session_state[f"transcription_area_{image_id}"] = img["transcription"]
-
-            # Re-save to audit DB if the image is already labeled (upsert)
-            if img.get("label"):
-                try:
-                    db.save_or_update_annotation(
-                        image_filename=img["filename"],
-                        label=img["label"],
-                        transcription=img["transcription"],
-                        doctor_name=st.session_state.get("doctor_name", ""),
-                        session_id=st.session_state.get("session_id", ""),
-                        locs_data=img.get("locs_data", {}),
-                    )
-                except Exception:
-                    pass
-
-            sm.update_activity()
-            st.rerun()
+
+    if image_id in st.session_state.get("_pending_transcriptions", {}):
+        _render_transcription_progress(image_id)
 
     # ── Editable transcription ───────────────────────────────────────────
     edited_text = st.text_area(
@@ -136,6 +241,7 @@ def render_recorder(image_id: str, model, language: str):
     # Sync edits back to session
     if edited_text != img["transcription"]:
         img["transcription"] = edited_text
+        sm.sync_image_counters(image_id)
         sm.update_activity()
 
     # ── Timestamped segments (Idea C) ────────────────────────────────────
@@ -143,10 +249,8 @@ def render_recorder(image_id: str, model, language: str):
     if segments:
         with st.expander(t("segments_timestamps"), expanded=False):
             for seg in segments:
-                ts_start = format_timestamp(seg["start"])
-                ts_end = format_timestamp(seg["end"])
                 st.markdown(
-                    f"`{ts_start} → {ts_end}` &nbsp; {seg['text']}"
+                    f"`{seg['_ts_start']} → {seg['_ts_end']}` &nbsp; {seg['text']}"
                 )
 
     # ── Helper buttons ───────────────────────────────────────────────────
@@ -6,12 +6,24 @@ Uses @st.dialog modals to warn about:
   - Session duplicates — informational notice.
 """
 
+import pandas as pd
 import streamlit as st
 import config
 import database as db
 from i18n import t
 from services import session_manager as sm
-from utils import validate_image_bytes
+from utils import IMAGE_HEADER_SIZE, validate_image_bytes
+
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def _previously_labeled_cached(version: int, names_key: frozenset) -> dict[str, list[dict]]:
+    """db.get_previously_labeled_filenames, cached per DB version and names.
+
+    Reruns between selecting files and confirming the upload ask for the
+    same names.  Local writes change *version*; the short TTL bounds how
+    stale writes from other app instances can get.
+    """
+    return db.get_previously_labeled_filenames(sorted(names_key))
 
 
 def _reset_uploader():
@@ -37,20 +49,37 @@ def _show_relabel_dialog():
         if non_labeled_count > 0:
             st.info(t("relabel_new_info", count=non_labeled_count))
 
-        relabel_choices = {}
+        # One editable table instead of one checkbox widget per file: large
+        # batches would otherwise rebuild hundreds of widgets per toggle.
+        rows = []
         for fname, records in prev.items():
             latest = records[0]
-            label_info = latest.get("label", "—")
-            doctor_info = latest.get("doctorName", "—")
-            ts_info = str(latest.get("createdAt", ""))[:16]
             n_times = len(records)
-            badge = t("times_badge_plural", n=n_times) if n_times > 1 else t("times_badge", n=n_times)
-
-            relabel_choices[fname] = st.checkbox(
-                f"**{fname}** — _{label_info}_ | {doctor_info} | {ts_info} ({badge})",
-                value=True,
-                key=f"_dlg_relabel_{fname}",
-            )
+            rows.append({
+                "file": fname,
+                "label": latest.get("label", "—"),
+                "doctor": latest.get("doctorName", "—"),
+                "date": str(latest.get("createdAt", ""))[:16],
+                "times": t("times_badge_plural", n=n_times) if n_times > 1 else t("times_badge", n=n_times),
+                "relabel": True,
+            })
+
+        edited = st.data_editor(
+            pd.DataFrame(rows),
+            column_config={
+                "file": st.column_config.TextColumn(t("col_image")),
+                "label": st.column_config.TextColumn(t("label_header")),
+                "doctor": st.column_config.TextColumn(t("doctor_header")),
+                "date": st.column_config.TextColumn(t("col_date")),
+                "times": st.column_config.TextColumn(t("col_times")),
+                "relabel": st.column_config.CheckboxColumn(t("col_relabel"), default=True),
+            },
+            disabled=["file", "label", "doctor", "date", "times"],
+            hide_index=True,
+            use_container_width=True,
+            key="_dlg_relabel_editor",
+        )
+        relabel_choices = dict(zip(edited["file"], edited["relabel"]))
 
         st.divider()
         col_a, col_b = st.columns(2)
@@ -67,29 +96,32 @@ def _show_relabel_dialog():
 def _process_pending(relabel_choices: dict[str, bool]):
     """Ingest accepted files from the pending review."""
     pending = st.session_state.pop("_pending_upload_review", None)
+    # Edits are stored by row position; don't carry them to the next review
+    st.session_state.pop("_dlg_relabel_editor", None)
     if not pending:
         st.rerun()
         return
 
     prev = pending["previously_labeled"]
     files_dict = pending["files"]
-    existing_filenames = {
-        img["filename"] for img in st.session_state.images.values()
-    }
+    existing_filenames = sm.get_existing_filenames()
 
     if "_processed_uploads" not in st.session_state:
         st.session_state._processed_uploads = set()
 
-    added = 0
+    to_add = []
     for fname, raw_bytes in files_dict.items():
         # If it was previously labeled and doctor unchecked it → skip
         if fname in prev and not relabel_choices.get(fname, True):
             continue
         if fname not in existing_filenames:
-            sm.add_image(fname, raw_bytes)
+            to_add.append((fname, raw_bytes))
             st.session_state._processed_uploads.add(fname)
-            st.session_state.session_downloaded = False
-            added += 1
+
+    sm.add_images(to_add)
+    added = len(to_add)
+    if added > 0:
+        st.session_state.session_downloaded = False
 
     _reset_uploader()
     if added > 0 and st.session_state.current_image_id is None:
@@ -100,25 +132,28 @@ def _process_pending(relabel_choices: dict[str, bool]):
 def _cancel_pending():
     """Cancel previously-labeled images but still ingest new (non-labeled) ones."""
     pending = st.session_state.pop("_pending_upload_review", None)
+    # Edits are stored by row position; don't carry them to the next review
+    st.session_state.pop("_dlg_relabel_editor", None)
     if pending:
         prev = pending["previously_labeled"]
         files_dict = pending["files"]
-        existing_filenames = {
-            img["filename"] for img in st.session_state.images.values()
-        }
+        existing_filenames = sm.get_existing_filenames()
         if "_processed_uploads" not in st.session_state:
             st.session_state._processed_uploads = set()
 
-        added = 0
+        to_add = []
         for fname, raw_bytes in files_dict.items():
             # Skip previously labeled — doctor chose to cancel them
             if fname in prev:
                 continue
             if fname not in existing_filenames:
-                sm.add_image(fname, raw_bytes)
+                to_add.append((fname, raw_bytes))
                 st.session_state._processed_uploads.add(fname)
-                st.session_state.session_downloaded = False
-                added += 1
+
+        sm.add_images(to_add)
+        added = len(to_add)
+        if added > 0:
+            st.session_state.session_downloaded = False
 
         if added > 0 and st.session_state.current_image_id is None:
             st.session_state.current_image_id = st.session_state.image_order[0]
@@ -183,9 +218,7 @@ def render_uploader():
     if "_processed_uploads" not in st.session_state:
         st.session_state._processed_uploads = set()
 
-    existing_filenames = {
-        img["filename"] for img in st.session_state.images.values()
-    }
+    existing_filenames = sm.get_existing_filenames()
 
     # ── Classify files ───────────────────────────────────────────────────
     new_files = []
@@ -204,17 +237,21 @@ def render_uploader():
         if uf.name in st.session_state._processed_uploads:
             continue
 
-        raw_bytes = uf.getvalue()
-        if not validate_image_bytes(raw_bytes):
+        # Sniff the magic bytes first; only valid images are copied whole
+        header = uf.read(IMAGE_HEADER_SIZE)
+        uf.seek(0)
+        if not validate_image_bytes(header):
             skipped_invalid += 1
             continue
 
-        new_files.append((uf.name, raw_bytes))
+        new_files.append((uf.name, uf.getvalue()))
 
     # ── Check DB for previously labeled images ───────────────────────────
     if new_files:
         new_filenames = [name for name, _ in new_files]
-        previously_labeled = db.get_previously_labeled_filenames(new_filenames)
+        previously_labeled = _previously_labeled_cached(
+            db.data_version(), frozenset(new_filenames),
+        )
 
         if previously_labeled:
             # Store all files (new + previously labeled) for review
@@ -229,18 +266,21 @@ def render_uploader():
             return 0
 
     # ── Ingest files that need no review ─────────────────────────────────
-    new_count = 0
+    to_add = []
     for name, raw_bytes in new_files:
         if name in existing_filenames:
             continue
         if name in st.session_state._processed_uploads:
             continue
 
-        sm.add_image(name, raw_bytes)
-        existing_filenames.add(name)
+        to_add.append((name, raw_bytes))
         st.session_state._processed_uploads.add(name)
+
+    # Thumbnails for the whole batch are built in parallel
+    sm.add_images(to_add)
+    new_count = len(to_add)
+    if new_count > 0:
         st.session_state.session_downloaded = False
-        new_count += 1
 
     if skipped_invalid > 0:
         st.warning(
@@ -1,5 +1,7 @@
 """OphthalmoCapture — Configuration Constants."""
 
+from types import MappingProxyType
+
 # ── Categorical Label Options ────────────────────────────────────────────────
 # Primary classification (radio buttons).
 LABEL_OPTIONS = [
@@ -59,6 +61,15 @@ LOCS_CORTICAL = {
 # Convenience list of all LOCS dropdowns
 LOCS_FIELDS = [LOCS_NUCLEAR_OPALESCENCE, LOCS_NUCLEAR_COLOR, LOCS_CORTICAL]
 
+# ── Read-only lookups (built once at import) ─────────────────────────────────
+# Stored labels are the English "display" names.
+LABEL_CODE_BY_DISPLAY = MappingProxyType(
+    {opt["display"]: opt["code"] for opt in LABEL_OPTIONS}
+)
+LOCS_FIELDS_BY_ID = MappingProxyType({f["field_id"]: f for f in LOCS_FIELDS})
+# In LOCS_FIELDS order (missing fields are reported in that order)
+LOCS_FIELD_IDS = tuple(LOCS_FIELDS_BY_ID)
+
 # ── Session Settings ─────────────────────────────────────────────────────────
 SESSION_TIMEOUT_MINUTES = 30
 
@@ -80,6 +91,17 @@ WHISPER_LANGUAGE_OPTIONS = {
 }
 DEFAULT_WHISPER_LANGUAGE = "es"
 
+# Derived once at import for the sidebar selectors.
+WHISPER_LANGUAGE_CODES = tuple(WHISPER_LANGUAGE_OPTIONS)
+# Models ending in ".en" → English only.  Others → multilingual.
+# "large" and "turbo" are multilingual and work for all languages.
+WHISPER_MODELS_EN = tuple(
+    m for m in WHISPER_MODEL_OPTIONS if m.endswith(".en") or m in ("large", "turbo")
+)
+WHISPER_MODELS_MULTILINGUAL = tuple(
+    m for m in WHISPER_MODEL_OPTIONS if not m.endswith(".en")
+)
+
 # ── App Metadata ─────────────────────────────────────────────────────────────
 APP_TITLE = "OphthalmoCapture"
 APP_ICON = "👁️"
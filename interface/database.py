@@ -5,28 +5,145 @@ doctor info, timestamps) for audit and history.  It NEVER stores images or audio
 """
 
 import os
+import contextlib
 import datetime
+import functools
+import hashlib
+import itertools
+import json
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Try importing firebase_admin
 try:
     import firebase_admin
     from firebase_admin import credentials, firestore
+    from google.api_core import exceptions as gexc
     FIREBASE_AVAILABLE = True
 except ImportError:
     FIREBASE_AVAILABLE = False
 
+# orjson is optional — a faster encoder for the locs_data column
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 DB_TYPE = "SQLITE"
 # Use /tmp for writable storage in Docker (ephemeral but always writable).
 # Locally, falls back to the script's own directory.
 _DB_DIR = "/tmp" if os.path.isdir("/tmp") else os.path.dirname(os.path.abspath(__file__))
 DB_FILE = os.path.join(_DB_DIR, "annotations.db")
-db_ref = None
+db_ref = None         # first Firestore client (see _fs())
+
+# ── SQLite connection ────────────────────────────────────────────────────────
+# One connection per process, shared by every helper instead of a
+# connect()/close() per call.  Autocommit mode: writes that need more than
+# one statement open their own transaction.  Streamlit serves each session
+# on its own thread, so all access goes through _LOCK.
+_CONN = None
+_SQLITE_READY = False
+_FTS_READY = False    # annotations_fts exists (SQLite built with FTS5 trigram)
+_UPSERT_READY = False  # ux_ann_file_session exists (ON CONFLICT upserts)
+# Stay well below SQLite's bound-parameter limit in IN (...) lookups
+_IN_CHUNK = 500
+_LOCK = threading.RLock()
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",       # ~20 MB page cache
+    "PRAGMA mmap_size=268435456",     # 256 MB
+)
+
+
+def _conn() -> sqlite3.Connection:
+    """Return the shared SQLite connection, opening it on first use.
+
+    Callers must hold _LOCK.
+    """
+    global _CONN
+    if _CONN is None:
+        conn = sqlite3.connect(
+            DB_FILE, check_same_thread=False, isolation_level=None,
+            cached_statements=256,
+        )
+        for pragma in _SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        _CONN = conn
+    return _CONN
+
+
+# Bumped by every write helper: read caches key on data_version() so they
+# are invalidated by this process's writes without querying the DB.
+_DB_VERSION = 0
+
+
+def data_version() -> int:
+    """Return a counter that changes whenever this process writes annotations."""
+    return _DB_VERSION
+
+
+def _bump_version():
+    global _DB_VERSION
+    _DB_VERSION += 1
+
+
+# ── Firestore fan-out ────────────────────────────────────────────────────────
+# Every Firestore call is a network round trip, so independent reads and
+# writes are pipelined on a small shared pool (created by init_db()).
+_POOL = None
+_FIRESTORE_RETRIES = 3
+
+# Several clients, each with its own gRPC channel, so concurrent calls are
+# not all multiplexed over one connection.  _fs() hands them out in turn.
+_FS_POOL_SIZE = 4
+_FS_CLIENTS = []
+_FS_COUNTER = itertools.count()
+
+
+def _fs():
+    """Return the next Firestore client (round-robin over _FS_CLIENTS)."""
+    return _FS_CLIENTS[next(_FS_COUNTER) % len(_FS_CLIENTS)]
+
+
+def _firestore_call(fn, *args, **kwargs):
+    """Run a Firestore call, retrying transient Aborted/DeadlineExceeded."""
+    for attempt in range(_FIRESTORE_RETRIES):
+        try:
+            return fn(*args, **kwargs)
+        except (gexc.Aborted, gexc.DeadlineExceeded):
+            if attempt == _FIRESTORE_RETRIES - 1:
+                raise
+            time.sleep(0.2 * 2 ** attempt)
+
+
+def _fan_out(fn, items) -> list:
+    """Map *fn* over *items* on _POOL (with retries); results in input order."""
+    return list(_POOL.map(lambda item: _firestore_call(fn, item), items))
+
+
+def _firestore_commit(client, writes: list[tuple], merge: bool = False):
+    """set() each (doc_ref, data) pair via WriteBatches committed in parallel.
+
+    *client* is the one the doc refs came from.  Firestore caps a batch at
+    500 writes.
+    """
+    batches = []
+    for i in range(0, len(writes), 500):
+        batch = client.batch()
+        for doc_ref, data in writes[i:i + 500]:
+            batch.set(doc_ref, data, merge=merge)
+        batches.append(batch)
+    _fan_out(lambda b: b.commit(), batches)
 
 
 def init_db():
     """Initialize the database connection (Firebase or SQLite fallback)."""
-    global DB_TYPE, db_ref
+    global DB_TYPE, db_ref, _POOL, _FS_CLIENTS
 
     # Try Firebase first
     if FIREBASE_AVAILABLE and os.path.exists("serviceAccountKey.json"):
@@ -34,69 +151,198 @@ def init_db():
             if not firebase_admin._apps:
                 cred = credentials.Certificate("serviceAccountKey.json")
                 firebase_admin.initialize_app(cred)
-            db_ref = firestore.client()
+            if not _FS_CLIENTS:
+                # firebase_admin caches one client per app, so each extra
+                # client gets its own named app
+                default_app = firebase_admin.get_app()
+                apps = [default_app]
+                for i in range(1, _FS_POOL_SIZE):
+                    name = f"firestore-{i}"
+                    if name not in firebase_admin._apps:
+                        firebase_admin.initialize_app(default_app.credential, name=name)
+                    apps.append(firebase_admin.get_app(name))
+                _FS_CLIENTS = [firestore.client(app) for app in apps]
+            db_ref = _FS_CLIENTS[0]
+            if _POOL is None:
+                _POOL = ThreadPoolExecutor(max_workers=10, thread_name_prefix="firestore")
             DB_TYPE = "FIREBASE"
             return "FIREBASE"
         except Exception as e:
             print(f"Firebase init failed: {e}")
 
-    # Fallback to SQLite
+    # Fallback to SQLite (schema is only checked once per process)
+    global _SQLITE_READY
     try:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS annotations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            image_filename TEXT NOT NULL,
-            label TEXT,
-            transcription TEXT,
-            doctor_name TEXT DEFAULT '',
-            created_at DATETIME
-        )''')
-        c.execute('''CREATE INDEX IF NOT EXISTS idx_ann_filename
-                      ON annotations (image_filename)''')
-        # Migration: add session_id column if it doesn't exist yet
-        try:
-            c.execute("ALTER TABLE annotations ADD COLUMN session_id TEXT DEFAULT ''")
-        except sqlite3.OperationalError:
-            pass  # column already exists
-        # Migration: add locs_data column (JSON string)
-        try:
-            c.execute("ALTER TABLE annotations ADD COLUMN locs_data TEXT DEFAULT ''")
-        except sqlite3.OperationalError:
-            pass  # column already exists
-        c.execute('''CREATE INDEX IF NOT EXISTS idx_ann_session
-                      ON annotations (image_filename, session_id)''')
-        conn.commit()
-        conn.close()
+        if not _SQLITE_READY:
+            with _LOCK:
+                c = _conn().cursor()
+                _init_sqlite_schema(c)
+            _SQLITE_READY = True
         DB_TYPE = "SQLITE"
         return "SQLITE"
     except Exception as e:
         raise Exception(f"Database initialization failed: {e}")
 
 
+_CREATE_UPSERT_INDEX = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_ann_file_session "
+    "ON annotations (image_filename, session_id) WHERE session_id <> ''"
+)
+
+
+def _init_sqlite_schema(c: sqlite3.Cursor):
+    """Create the annotations table, indexes and column migrations."""
+    c.execute('''CREATE TABLE IF NOT EXISTS annotations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_filename TEXT NOT NULL,
+        label TEXT,
+        transcription TEXT,
+        doctor_name TEXT DEFAULT '',
+        created_at DATETIME
+    )''')
+    # Migration: add session_id column if it doesn't exist yet
+    try:
+        c.execute("ALTER TABLE annotations ADD COLUMN session_id TEXT DEFAULT ''")
+    except sqlite3.OperationalError:
+        pass  # column already exists
+    # Migration: add locs_data column (JSON string)
+    try:
+        c.execute("ALTER TABLE annotations ADD COLUMN locs_data TEXT DEFAULT ''")
+    except sqlite3.OperationalError:
+        pass  # column already exists
+    # Per-file history (latest first); its image_filename prefix also serves
+    # plain filename lookups, so the old single-column indexes are redundant.
+    c.execute('''CREATE INDEX IF NOT EXISTS ix_ann_fname_created
+                  ON annotations (image_filename, created_at DESC)''')
+    c.execute("DROP INDEX IF EXISTS idx_ann_filename")
+    c.execute("DROP INDEX IF EXISTS idx_ann_session")
+    # One row per (image, session) — the conflict target of the upsert.
+    # Partial: save_annotation() rows have no session and may repeat.
+    global _UPSERT_READY
+    try:
+        c.execute(_CREATE_UPSERT_INDEX)
+        _UPSERT_READY = True
+    except sqlite3.IntegrityError:
+        # Older databases may hold duplicate (image, session) rows.  Audit
+        # rows are never deleted here: keep the update-then-insert path
+        # until the data is migrated on purpose.
+        print("annotations has duplicate (image_filename, session_id) rows; "
+              "skipping ux_ann_file_session, upserts use SELECT/UPDATE")
+    _init_sqlite_fts(c)
+
+
+def _init_sqlite_fts(c: sqlite3.Cursor):
+    """Index image_filename in an FTS5 trigram table for substring search.
+
+    External-content table kept in sync by triggers.  Older SQLite builds
+    without FTS5/trigram keep searching with LIKE.
+    """
+    global _FTS_READY
+    c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'annotations_fts'"
+    )
+    exists = c.fetchone() is not None
+    try:
+        c.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS annotations_fts USING fts5("
+            "image_filename, content='annotations', content_rowid='id', "
+            "tokenize='trigram')"
+        )
+    except sqlite3.OperationalError:
+        _FTS_READY = False
+        return
+    c.execute('''CREATE TRIGGER IF NOT EXISTS annotations_fts_ai
+                  AFTER INSERT ON annotations BEGIN
+                      INSERT INTO annotations_fts (rowid, image_filename)
+                      VALUES (new.id, new.image_filename);
+                  END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS annotations_fts_ad
+                  AFTER DELETE ON annotations BEGIN
+                      INSERT INTO annotations_fts (annotations_fts, rowid, image_filename)
+                      VALUES ('delete', old.id, old.image_filename);
+                  END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS annotations_fts_au
+                  AFTER UPDATE OF image_filename ON annotations BEGIN
+                      INSERT INTO annotations_fts (annotations_fts, rowid, image_filename)
+                      VALUES ('delete', old.id, old.image_filename);
+                      INSERT INTO annotations_fts (rowid, image_filename)
+                      VALUES (new.id, new.image_filename);
+                  END''')
+    if not exists:
+        # Index the rows written before the table existed
+        c.execute("INSERT INTO annotations_fts (annotations_fts) VALUES ('rebuild')")
+    _FTS_READY = True
+
+
+@contextlib.contextmanager
+def _transaction():
+    """Hold _LOCK and run the block inside BEGIN IMMEDIATE … COMMIT."""
+    with _LOCK:
+        conn = _conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+@contextlib.contextmanager
+def _read_snapshot():
+    """Run the block's reads in one deferred transaction (same snapshot).
+
+    The caller holds _LOCK.  Yields a cursor.
+    """
+    conn = _conn()
+    conn.execute("BEGIN")
+    try:
+        yield conn.cursor()
+    finally:
+        conn.execute("COMMIT")
+
+
 def save_annotation(image_filename, label, transcription, doctor_name=""):
     """Save an annotation record (always INSERT).  Stores metadata only."""
     timestamp = datetime.datetime.now()
+    save_annotations_bulk([
+        (image_filename, label, transcription, doctor_name, timestamp),
+    ])
+
+
+def save_annotations_bulk(rows: list[tuple]):
+    """INSERT many annotation records in one transaction.
+
+    Each row is (image_filename, label, transcription, doctor_name, created_at).
+    """
+    if not rows:
+        return
 
     if DB_TYPE == "FIREBASE":
-        db_ref.collection("annotations").add({
-            "imageFilename": image_filename,
-            "label": label,
-            "transcription": transcription,
-            "doctorName": doctor_name,
-            "createdAt": timestamp,
-        })
+        fs = _fs()
+        collection = fs.collection("annotations")
+        writes = []
+        latest = {}
+        for image_filename, label, transcription, doctor_name, timestamp in rows:
+            writes.append((collection.document(), {
+                "imageFilename": image_filename,
+                "label": label,
+                "transcription": transcription,
+                "doctorName": doctor_name,
+                "createdAt": timestamp,
+            }))
+            if image_filename not in latest or timestamp > latest[image_filename]:
+                latest[image_filename] = timestamp
+        _firestore_commit(fs, writes + _group_writes(fs, latest), merge=True)
     else:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO annotations "
-            "(image_filename, label, transcription, doctor_name, created_at) "
-            "VALUES (?, ?, ?, ?, ?)",
-            (image_filename, label, transcription, doctor_name, timestamp),
-        )
-        conn.commit()
-        conn.close()
+        with _transaction() as conn:
+            conn.executemany(
+                "INSERT INTO annotations "
+                "(image_filename, label, transcription, doctor_name, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+    _bump_version()
 
 
 def save_or_update_annotation(
@@ -108,73 +354,183 @@ def save_or_update_annotation(
     If a record for (image_filename, session_id) already exists → UPDATE it.
     Otherwise → INSERT a new one.
     """
-    import json as _json
+    save_or_update_annotations_bulk([{
+        "image_filename": image_filename,
+        "label": label,
+        "transcription": transcription,
+        "doctor_name": doctor_name,
+        "session_id": session_id,
+        "locs_data": locs_data,
+    }])
+
+
+def save_or_update_annotations_bulk(records: list[dict]):
+    """Upsert many records (save_or_update_annotation kwargs) at once.
+
+    On SQLite all upserts share a single transaction, so a flush of
+    several pending edits costs one commit instead of one per image.
+    """
     timestamp = datetime.datetime.now()
-    locs_json = _json.dumps(locs_data or {}, ensure_ascii=False)
 
     if DB_TYPE == "FIREBASE":
-        # Query for existing doc with matching filename + session
-        docs = list(
-            db_ref.collection("annotations")
-            .where("imageFilename", "==", image_filename)
-            .where("sessionId", "==", session_id)
-            .limit(1)
-            .stream()
+        # Deterministic doc ids make the upsert a blind set(merge=True):
+        # no read before write, and every record fits in a batched commit
+        fs = _fs()
+        collection = fs.collection("annotations")
+        writes = []
+        for rec in records:
+            doc_id, data = _firestore_upsert_doc(timestamp=timestamp, **rec)
+            writes.append((collection.document(doc_id), data))
+        latest = dict.fromkeys((rec["image_filename"] for rec in records), timestamp)
+        _firestore_commit(fs, writes + _group_writes(fs, latest), merge=True)
+    else:
+        with _transaction() as conn:
+            for rec in records:
+                locs_json = _locs_json(tuple(sorted((rec.get("locs_data") or {}).items())))
+                _upsert_sqlite(conn, timestamp, locs_json, **rec)
+    _bump_version()
+
+
+@functools.lru_cache(maxsize=512)
+def _locs_json(items: tuple) -> str:
+    """Encode locs_data (given as sorted items) for the SQLite column.
+
+    LOCS grades only have a few hundred combinations, so autosaves of the
+    same grades reuse the cached string.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(dict(items)).decode()
+    return json.dumps(dict(items), ensure_ascii=False)
+
+
+def _doc_id(*parts: str) -> str:
+    """Deterministic Firestore document id for the given key parts."""
+    return hashlib.blake2b("|".join(parts).encode(), digest_size=16).hexdigest()
+
+
+# ── Firestore annotation_groups ──────────────────────────────────────────────
+# One small document per image filename holding its newest createdAt, kept
+# up to date by every save, so grouped history pages without reading the
+# whole annotations collection.
+_GROUPS_READY = False
+
+
+def _group_writes(client, latest: dict) -> list[tuple]:
+    """(doc_ref, data) writes for {image_filename: newest createdAt}."""
+    groups = client.collection("annotation_groups")
+    return [
+        (groups.document(_doc_id(fname)), {"imageFilename": fname, "latestAt": ts})
+        for fname, ts in latest.items()
+    ]
+
+
+def _ensure_annotation_groups():
+    """Backfill annotation_groups once from annotations saved before it existed."""
+    global _GROUPS_READY
+    if _GROUPS_READY:
+        return
+    # Saves write groups too, so completion is recorded in a marker doc
+    fs = _fs()
+    marker = fs.collection("_meta").document("annotation_groups")
+    if not marker.get().exists:
+        latest = {}
+        docs = fs.collection("annotations").select(["imageFilename", "createdAt"]).stream()
+        for doc in docs:
+            d = doc.to_dict()
+            fname = d.get("imageFilename", "")
+            ts = _created_at(d)
+            if fname not in latest or ts > latest[fname]:
+                latest[fname] = ts
+        _firestore_commit(
+            fs, _group_writes(fs, latest) + [(marker, {"backfilled": True})], merge=True,
+        )
+    _GROUPS_READY = True
+
+
+def _firestore_upsert_doc(
+    image_filename, label, transcription, doctor_name="", session_id="",
+    locs_data=None, timestamp=None,
+):
+    """Firestore half of save_or_update_annotation: (doc_id, fields).
+
+    The id is derived from (image_filename, session_id), so repeated saves
+    in a session overwrite the same document.
+    """
+    return _doc_id(image_filename, session_id), {
+        "imageFilename": image_filename,
+        "label": label,
+        "transcription": transcription,
+        "doctorName": doctor_name,
+        "sessionId": session_id,
+        "locsData": locs_data or {},
+        "createdAt": timestamp,
+    }
+
+
+def _upsert_sqlite(
+    conn, timestamp, locs_json,
+    image_filename, label, transcription, doctor_name="", session_id="",
+    locs_data=None,
+):
+    """SQLite half of save_or_update_annotation (caller owns the transaction)."""
+    if session_id and _UPSERT_READY:
+        # Single statement against the ux_ann_file_session unique index
+        conn.execute(
+            "INSERT INTO annotations "
+            "(image_filename, label, transcription, doctor_name, "
+            "created_at, session_id, locs_data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (image_filename, session_id) WHERE session_id <> '' "
+            "DO UPDATE SET label = excluded.label, "
+            "transcription = excluded.transcription, "
+            "doctor_name = excluded.doctor_name, "
+            "created_at = excluded.created_at, "
+            "locs_data = excluded.locs_data",
+            (image_filename, label, transcription, doctor_name,
+             timestamp, session_id, locs_json),
+        )
+        return
+
+    # No session id (not covered by the partial index) or no index: by hand
+    row = conn.execute(
+        "SELECT id FROM annotations "
+        "WHERE image_filename = ? AND session_id = ? LIMIT 1",
+        (image_filename, session_id),
+    ).fetchone()
+    if row:
+        conn.execute(
+            "UPDATE annotations "
+            "SET label = ?, transcription = ?, doctor_name = ?, "
+            "created_at = ?, locs_data = ? "
+            "WHERE id = ?",
+            (label, transcription, doctor_name, timestamp, locs_json, row[0]),
         )
-        if docs:
-            docs[0].reference.update({
-                "label": label,
-                "transcription": transcription,
-                "doctorName": doctor_name,
-                "locsData": locs_data or {},
-                "createdAt": timestamp,
-            })
-        else:
-            db_ref.collection("annotations").add({
-                "imageFilename": image_filename,
-                "label": label,
-                "transcription": transcription,
-                "doctorName": doctor_name,
-                "sessionId": session_id,
-                "locsData": locs_data or {},
-                "createdAt": timestamp,
-            })
     else:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        c = conn.cursor()
-        # Check if a row for this image+session already exists
-        c.execute(
-            "SELECT id FROM annotations "
-            "WHERE image_filename = ? AND session_id = ? LIMIT 1",
-            (image_filename, session_id),
+        conn.execute(
+            "INSERT INTO annotations "
+            "(image_filename, label, transcription, doctor_name, "
+            "created_at, session_id, locs_data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (image_filename, label, transcription, doctor_name,
+             timestamp, session_id, locs_json),
         )
-        row = c.fetchone()
-        if row:
-            c.execute(
-                "UPDATE annotations "
-                "SET label = ?, transcription = ?, doctor_name = ?, "
-                "created_at = ?, locs_data = ? "
-                "WHERE id = ?",
-                (label, transcription, doctor_name, timestamp, locs_json, row[0]),
-            )
-        else:
-            c.execute(
-                "INSERT INTO annotations "
-                "(image_filename, label, transcription, doctor_name, "
-                "created_at, session_id, locs_data) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (image_filename, label, transcription, doctor_name,
-                 timestamp, session_id, locs_json),
-            )
-        conn.commit()
-        conn.close()
+
+
+# Record keys for rows selected as
+# (image_filename, label, transcription, doctor_name, created_at)
+_RECORD_KEYS = ("imageFilename", "label", "transcription", "doctorName", "createdAt")
+
+
+def _record(row: tuple) -> dict:
+    """Map a selected annotation row to the record dict the UI consumes."""
+    return dict(zip(_RECORD_KEYS, row))
 
 
 def get_latest_annotation(image_filename):
     """Retrieve the most recent annotation for a given image filename."""
     if DB_TYPE == "FIREBASE":
         docs = (
-            db_ref.collection("annotations")
+            _fs().collection("annotations")
             .where("imageFilename", "==", image_filename)
             .order_by("createdAt", direction=firestore.Query.DESCENDING)
             .limit(1)
@@ -184,26 +540,105 @@ def get_latest_annotation(image_filename):
             return doc.to_dict()
         return None
     else:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        c = conn.cursor()
-        c.execute(
-            "SELECT image_filename, label, transcription, doctor_name, created_at "
-            "FROM annotations WHERE image_filename = ? ORDER BY id DESC LIMIT 1",
-            (image_filename,),
-        )
-        row = c.fetchone()
-        conn.close()
+        with _LOCK:
+            c = _conn().cursor()
+            c.execute(
+                "SELECT image_filename, label, transcription, doctor_name, created_at "
+                "FROM annotations WHERE image_filename = ? ORDER BY created_at DESC LIMIT 1",
+                (image_filename,),
+            )
+            row = c.fetchone()
         if row:
-            return {
-                "imageFilename": row[0],
-                "label": row[1],
-                "transcription": row[2],
-                "doctorName": row[3],
-                "createdAt": row[4],
-            }
+            return _record(row)
         return None
 
 
+# ── History queries ──────────────────────────────────────────────────────────
+# Literal SQL per variant (no search / LIKE search / FTS search) so every
+# call hits the connection's prepared-statement cache; only the parameters
+# vary.  Search variants are keyed by the mode _search_filter() returns.
+_SEARCH_FILTERS = {
+    "like": "image_filename LIKE ?",
+    "fts": "id IN (SELECT rowid FROM annotations_fts WHERE annotations_fts MATCH ?)",
+}
+_SQL_HISTORY_COUNT = "SELECT COUNT(*) FROM annotations"
+_SQL_HISTORY_COUNT_SEARCH = {
+    mode: f"SELECT COUNT(*) FROM annotations WHERE {where}"
+    for mode, where in _SEARCH_FILTERS.items()
+}
+_SQL_HISTORY_PAGE = (
+    "SELECT image_filename, label, transcription, doctor_name, created_at "
+    "FROM annotations ORDER BY id DESC LIMIT ? OFFSET ?"
+)
+_SQL_HISTORY_PAGE_SEARCH = {
+    mode: "SELECT image_filename, label, transcription, doctor_name, created_at "
+          f"FROM annotations WHERE {where} "
+          "ORDER BY id DESC LIMIT ? OFFSET ?"
+    for mode, where in _SEARCH_FILTERS.items()
+}
+_SQL_GROUPED_COUNT = "SELECT COUNT(DISTINCT image_filename) FROM annotations"
+_SQL_GROUPED_COUNT_SEARCH = {
+    mode: f"SELECT COUNT(DISTINCT image_filename) FROM annotations WHERE {where}"
+    for mode, where in _SEARCH_FILTERS.items()
+}
+# Groups are ordered by (latest, image_filename) so a page boundary is a
+# well-defined keyset cursor; the *_AFTER variants resume right after one
+# instead of counting past OFFSET rows.  The OFFSET variants also return
+# the number of groups (window over the grouped rows, before LIMIT), so
+# the first page needs no separate COUNT.
+_SQL_GROUPED_PAGE = (
+    "SELECT image_filename, MAX(created_at) as latest, COUNT(*) OVER () FROM annotations "
+    "GROUP BY image_filename ORDER BY latest DESC, image_filename DESC LIMIT ? OFFSET ?"
+)
+_SQL_GROUPED_PAGE_SEARCH = {
+    mode: "SELECT image_filename, MAX(created_at) as latest, COUNT(*) OVER () FROM annotations "
+          f"WHERE {where} "
+          "GROUP BY image_filename ORDER BY latest DESC, image_filename DESC LIMIT ? OFFSET ?"
+    for mode, where in _SEARCH_FILTERS.items()
+}
+_GROUPED_AFTER = "HAVING latest < ? OR (latest = ? AND image_filename < ?) "
+_SQL_GROUPED_PAGE_AFTER = (
+    "SELECT image_filename, MAX(created_at) as latest FROM annotations "
+    f"GROUP BY image_filename {_GROUPED_AFTER}"
+    "ORDER BY latest DESC, image_filename DESC LIMIT ?"
+)
+_SQL_GROUPED_PAGE_AFTER_SEARCH = {
+    mode: "SELECT image_filename, MAX(created_at) as latest FROM annotations "
+          f"WHERE {where} "
+          f"GROUP BY image_filename {_GROUPED_AFTER}"
+          "ORDER BY latest DESC, image_filename DESC LIMIT ?"
+    for mode, where in _SEARCH_FILTERS.items()
+}
+
+
+def _search_filter(search_query: str) -> tuple[str, str]:
+    """Return (mode, bound parameter) for a filename substring search.
+
+    Trigram FTS needs at least three characters; shorter queries (or
+    SQLite builds without FTS5) fall back to LIKE.
+    """
+    if _FTS_READY and len(search_query) >= 3:
+        return "fts", '"' + search_query.replace('"', '""') + '"'
+    return "like", f"%{search_query}%"
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _created_at(record: dict) -> datetime.datetime:
+    """Sort key for a Firestore record: its createdAt timestamp itself.
+
+    Firestore returns tz-aware datetimes, which compare natively (no string
+    formatting per comparison); records without one sort last.
+    """
+    return record.get("createdAt") or _EPOCH
+
+
+def _firestore_count(query) -> int:
+    """Run a server-side count() aggregation for a Firestore query."""
+    return query.count().get()[0][0].value
+
+
 def get_history_paginated(search_query="", page=1, per_page=10):
     """Retrieve annotation history with search and pagination.
 
@@ -214,7 +649,7 @@ def get_history_paginated(search_query="", page=1, per_page=10):
     total_count = 0
 
     if DB_TYPE == "FIREBASE":
-        ref = db_ref.collection("annotations")
+        ref = _fs().collection("annotations")
         if search_query:
             query = (
                 ref.where("imageFilename", ">=", search_query)
@@ -223,47 +658,25 @@ def get_history_paginated(search_query="", page=1, per_page=10):
         else:
             query = ref.order_by("createdAt", direction=firestore.Query.DESCENDING)
 
-        all_docs = list(query.stream())
-        total_count = len(all_docs)
-        for doc in all_docs[offset : offset + per_page]:
+        # Count server-side and only transfer the requested page
+        total_count = _firestore_count(query)
+        for doc in query.offset(offset).limit(per_page).stream():
             history.append(doc.to_dict())
 
     else:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        c = conn.cursor()
-
-        # Count
-        if search_query:
-            c.execute(
-                "SELECT COUNT(*) FROM annotations WHERE image_filename LIKE ?",
-                (f"%{search_query}%",),
-            )
-        else:
-            c.execute("SELECT COUNT(*) FROM annotations")
-        total_count = c.fetchone()[0]
-
-        # Fetch page
-        sql = (
-            "SELECT image_filename, label, transcription, doctor_name, created_at "
-            "FROM annotations"
-        )
-        params = []
-        if search_query:
-            sql += " WHERE image_filename LIKE ?"
-            params.append(f"%{search_query}%")
-        sql += " ORDER BY id DESC LIMIT ? OFFSET ?"
-        params.extend([per_page, offset])
-
-        c.execute(sql, params)
-        for row in c.fetchall():
-            history.append({
-                "imageFilename": row[0],
-                "label": row[1],
-                "transcription": row[2],
-                "doctorName": row[3],
-                "createdAt": row[4],
-            })
-        conn.close()
+        with _LOCK:
+            c = _conn().cursor()
+
+            if search_query:
+                mode, pattern = _search_filter(search_query)
+                c.execute(_SQL_HISTORY_COUNT_SEARCH[mode], (pattern,))
+                total_count = c.fetchone()[0]
+                c.execute(_SQL_HISTORY_PAGE_SEARCH[mode], (pattern, per_page, offset))
+            else:
+                c.execute(_SQL_HISTORY_COUNT)
+                total_count = c.fetchone()[0]
+                c.execute(_SQL_HISTORY_PAGE, (per_page, offset))
+            history = [_record(row) for row in c.fetchall()]
 
     return history, total_count
 
@@ -271,22 +684,21 @@ def get_history_paginated(search_query="", page=1, per_page=10):
 def get_annotation_stats():
     """Get summary statistics of all stored annotations."""
     if DB_TYPE == "FIREBASE":
-        docs = list(db_ref.collection("annotations").stream())
-        total = len(docs)
+        # Every stored label keeps its own key (legacy/renamed ones too), so
+        # the docs are read — but projected to the label field only
+        docs = _fs().collection("annotations").select(["label"]).stream()
         labels = {}
         for doc in docs:
             lbl = doc.to_dict().get("label", "sin_etiqueta")
             labels[lbl] = labels.get(lbl, 0) + 1
-        return {"total": total, "by_label": labels}
+        return {"total": sum(labels.values()), "by_label": labels}
     else:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM annotations")
-        total = c.fetchone()[0]
-        c.execute("SELECT label, COUNT(*) FROM annotations GROUP BY label")
-        labels = {row[0]: row[1] for row in c.fetchall()}
-        conn.close()
-        return {"total": total, "by_label": labels}
+        # The total is the sum of the per-label counts — one query
+        with _LOCK:
+            rows = _conn().execute(
+                "SELECT label, COUNT(*) FROM annotations GROUP BY label"
+            ).fetchall()
+        return {"total": sum(n for _, n in rows), "by_label": dict(rows)}
 
 
 def get_previously_labeled_filenames(filenames: list[str]) -> dict[str, list[dict]]:
@@ -301,38 +713,35 @@ def get_previously_labeled_filenames(filenames: list[str]) -> dict[str, list[dic
     result = {}
 
     if DB_TYPE == "FIREBASE":
-        # Firestore doesn't support 'IN' with >30 items, so batch
-        for fname in filenames:
+        def _fetch(chunk):
             docs = (
-                db_ref.collection("annotations")
-                .where("imageFilename", "==", fname)
-                .order_by("createdAt", direction=firestore.Query.DESCENDING)
+                _fs().collection("annotations")
+                .where("imageFilename", "in", chunk)
                 .stream()
             )
-            records = [doc.to_dict() for doc in docs]
-            if records:
-                result[fname] = records
+            return [doc.to_dict() for doc in docs]
+
+        # 'in' takes at most 30 values: one query per chunk, run concurrently
+        chunks = [filenames[i:i + 30] for i in range(0, len(filenames), 30)]
+        for docs in _fan_out(_fetch, chunks):
+            for doc in docs:
+                result.setdefault(doc.get("imageFilename", ""), []).append(doc)
+        for records in result.values():
+            records.sort(key=_created_at, reverse=True)
     else:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        c = conn.cursor()
-        placeholders = ",".join("?" for _ in filenames)
-        c.execute(
-            f"SELECT image_filename, label, transcription, doctor_name, created_at "
-            f"FROM annotations WHERE image_filename IN ({placeholders}) "
-            f"ORDER BY created_at DESC",
-            filenames,
-        )
-        for row in c.fetchall():
-            fname = row[0]
-            record = {
-                "imageFilename": row[0],
-                "label": row[1],
-                "transcription": row[2],
-                "doctorName": row[3],
-                "createdAt": row[4],
-            }
-            result.setdefault(fname, []).append(record)
-        conn.close()
+        with _LOCK:
+            c = _conn().cursor()
+            for i in range(0, len(filenames), _IN_CHUNK):
+                chunk = filenames[i:i + _IN_CHUNK]
+                placeholders = ",".join("?" for _ in chunk)
+                c.execute(
+                    f"SELECT image_filename, label, transcription, doctor_name, created_at "
+                    f"FROM annotations WHERE image_filename IN ({placeholders}) "
+                    f"ORDER BY created_at DESC",
+                    chunk,
+                )
+                for row in c.fetchall():
+                    result.setdefault(row[0], []).append(_record(row))
 
     return result
 
@@ -341,130 +750,131 @@ def get_all_annotations_for_file(image_filename: str) -> list[dict]:
     """Retrieve ALL annotations for a given image filename, ordered by date desc."""
     if DB_TYPE == "FIREBASE":
         docs = (
-            db_ref.collection("annotations")
+            _fs().collection("annotations")
             .where("imageFilename", "==", image_filename)
             .order_by("createdAt", direction=firestore.Query.DESCENDING)
             .stream()
         )
         return [doc.to_dict() for doc in docs]
     else:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        c = conn.cursor()
-        c.execute(
-            "SELECT image_filename, label, transcription, doctor_name, created_at "
-            "FROM annotations WHERE image_filename = ? ORDER BY created_at DESC",
-            (image_filename,),
-        )
-        results = []
-        for row in c.fetchall():
-            results.append({
-                "imageFilename": row[0],
-                "label": row[1],
-                "transcription": row[2],
-                "doctorName": row[3],
-                "createdAt": row[4],
-            })
-        conn.close()
+        with _LOCK:
+            c = _conn().cursor()
+            c.execute(
+                "SELECT image_filename, label, transcription, doctor_name, created_at "
+                "FROM annotations WHERE image_filename = ? ORDER BY created_at DESC",
+                (image_filename,),
+            )
+            results = [_record(row) for row in c.fetchall()]
         return results
 
 
-def get_history_grouped(search_query="", page=1, per_page=10):
+def get_history_grouped(search_query="", page=1, per_page=10, after=None):
     """Retrieve annotation history GROUPED by image filename.
 
-    Returns: (list_of_groups, total_unique_images)
+    Returns: (list_of_groups, total_unique_images, next_cursor)
     Each group = {"imageFilename": str, "annotations": [list of records]}
     sorted by most recent annotation date per image.
+
+    *after* is the next_cursor returned for the previous page.  When given,
+    the page starts right after it (keyset pagination) and *page* is only
+    used as a fallback; next_cursor is None when there is no next page.
     """
     offset = (page - 1) * per_page
 
     if DB_TYPE == "FIREBASE":
-        ref = db_ref.collection("annotations")
+        # Page over the per-filename summaries instead of every annotation;
+        # full records are fetched for the page's filenames alone.
+        _ensure_annotation_groups()
+        groups = _fs().collection("annotation_groups")
         if search_query:
-            query = (
-                ref.where("imageFilename", ">=", search_query)
+            # Prefix range on the filename, so the order is applied locally
+            matched = [
+                doc.to_dict() for doc in
+                groups.where("imageFilename", ">=", search_query)
                 .where("imageFilename", "<=", search_query + "\uf8ff")
-            )
+                .stream()
+            ]
+            matched.sort(key=lambda g: g.get("latestAt") or _EPOCH, reverse=True)
+            total_unique = len(matched)
+            page_fnames = [g["imageFilename"] for g in matched[offset:offset + per_page]]
+            # Already sliced locally; a cursor would not save any reads
+            next_cursor = None
         else:
-            query = ref.order_by("createdAt", direction=firestore.Query.DESCENDING)
-
-        all_docs = [doc.to_dict() for doc in query.stream()]
-
-        # Group by filename
-        grouped = {}
-        for doc in all_docs:
-            fname = doc.get("imageFilename", "")
-            grouped.setdefault(fname, []).append(doc)
-
-        # Sort groups by most recent annotation
-        sorted_groups = sorted(
-            grouped.items(),
-            key=lambda x: max(str(a.get("createdAt", "")) for a in x[1]),
-            reverse=True,
-        )
-
-        total_unique = len(sorted_groups)
-        page_groups = sorted_groups[offset:offset + per_page]
-
-        result = []
-        for fname, annotations in page_groups:
-            result.append({
-                "imageFilename": fname,
-                "annotations": sorted(
-                    annotations,
-                    key=lambda a: str(a.get("createdAt", "")),
-                    reverse=True,
-                ),
-            })
-
-        return result, total_unique
-    else:
-        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        c = conn.cursor()
-
-        # Count unique filenames
-        where = ""
-        params = []
-        if search_query:
-            where = " WHERE image_filename LIKE ?"
-            params.append(f"%{search_query}%")
-
-        c.execute(
-            f"SELECT COUNT(DISTINCT image_filename) FROM annotations{where}",
-            params,
-        )
-        total_unique = c.fetchone()[0]
-
-        # Get unique filenames for this page, sorted by most recent
-        c.execute(
-            f"SELECT image_filename, MAX(created_at) as latest "
-            f"FROM annotations{where} "
-            f"GROUP BY image_filename ORDER BY latest DESC "
-            f"LIMIT ? OFFSET ?",
-            params + [per_page, offset],
-        )
-        page_filenames = [row[0] for row in c.fetchall()]
-
-        # Fetch all annotations for those filenames
-        result = []
-        for fname in page_filenames:
-            c.execute(
-                "SELECT image_filename, label, transcription, doctor_name, created_at "
-                "FROM annotations WHERE image_filename = ? ORDER BY created_at DESC",
-                (fname,),
+            total_unique = _firestore_count(groups)
+            query = (
+                groups.order_by("latestAt", direction=firestore.Query.DESCENDING)
+                .order_by("__name__", direction=firestore.Query.DESCENDING)
             )
-            annotations = []
-            for row in c.fetchall():
-                annotations.append({
-                    "imageFilename": row[0],
-                    "label": row[1],
-                    "transcription": row[2],
-                    "doctorName": row[3],
-                    "createdAt": row[4],
-                })
-            result.append({
-                "imageFilename": fname,
-                "annotations": annotations,
-            })
-
-        conn.close()
-        return result, total_unique
+            # Skipped documents are billed as reads; start after the cursor
+            if after is not None:
+                query = query.start_after({"latestAt": after[0], "__name__": after[1]})
+            else:
+                query = query.offset(offset)
+            page_docs = [doc.to_dict() for doc in query.limit(per_page).stream()]
+            page_fnames = [d["imageFilename"] for d in page_docs]
+            next_cursor = None
+            if len(page_docs) == per_page:
+                last = page_docs[-1]
+                next_cursor = (last["latestAt"], _doc_id(last["imageFilename"]))
+
+        records = get_previously_labeled_filenames(page_fnames)
+        result = [
+            {"imageFilename": fname, "annotations": records[fname]}
+            for fname in page_fnames
+            if fname in records
+        ]
+
+        return result, total_unique, next_cursor
+    else:
+        mode, pattern = _search_filter(search_query) if search_query else (None, None)
+        if mode:
+            count_sql, count_args = _SQL_GROUPED_COUNT_SEARCH[mode], (pattern,)
+        else:
+            count_sql, count_args = _SQL_GROUPED_COUNT, ()
+
+        with _LOCK, _read_snapshot() as c:
+            # This page's filenames (most recent first) and the number of
+            # unique filenames, read from one snapshot
+            if after is not None:
+                c.execute(count_sql, count_args)
+                total_unique = c.fetchone()[0]
+                if mode:
+                    c.execute(_SQL_GROUPED_PAGE_AFTER_SEARCH[mode], (pattern, after[0], after[0], after[1], per_page))
+                else:
+                    c.execute(_SQL_GROUPED_PAGE_AFTER, (after[0], after[0], after[1], per_page))
+                page_rows = c.fetchall()
+            else:
+                if mode:
+                    c.execute(_SQL_GROUPED_PAGE_SEARCH[mode], (pattern, per_page, offset))
+                else:
+                    c.execute(_SQL_GROUPED_PAGE, (per_page, offset))
+                page_rows = c.fetchall()
+                if page_rows:
+                    total_unique = page_rows[0][2]
+                else:
+                    # Empty (or past the last) page: the window had no rows
+                    c.execute(count_sql, count_args)
+                    total_unique = c.fetchone()[0]
+            page_filenames = [row[0] for row in page_rows]
+            next_cursor = None
+            if len(page_rows) == per_page:
+                next_cursor = (page_rows[-1][1], page_rows[-1][0])
+
+            # Fetch all annotations for those filenames in one statement
+            grouped: dict[str, list] = {f: [] for f in page_filenames}
+            if page_filenames:
+                placeholders = ",".join("?" for _ in page_filenames)
+                c.execute(
+                    f"SELECT image_filename, label, transcription, doctor_name, created_at "
+                    f"FROM annotations WHERE image_filename IN ({placeholders}) "
+                    f"ORDER BY created_at DESC",
+                    page_filenames,
+                )
+                for row in c.fetchall():
+                    grouped[row[0]].append(_record(row))
+
+        result = [
+            {"imageFilename": fname, "annotations": annotations}
+            for fname, annotations in grouped.items()
+        ]
+        return result, total_unique, next_cursor
@@ -4,15 +4,32 @@ Centralized UI strings with session-state-based language selection.
 All components call t(key) to get translated strings.
 """
 
+import sys
+import threading
 import streamlit as st
 
 SUPPORTED_LANGUAGES = {"es": "Español", "en": "English"}
+LANGUAGE_CODES = tuple(SUPPORTED_LANGUAGES)
 DEFAULT_LANGUAGE = "es"
 
 
+# Each session's script runs on its own thread, so the language read from
+# session state is memoized per thread and cleared at the start of every
+# full run by reset_run_cache() (language changes always trigger one).
+_RUN = threading.local()
+
+
+def reset_run_cache():
+    """Forget the memoized UI language; call once at the top of each run."""
+    _RUN.lang = None
+
+
 def _get_lang() -> str:
     """Return the active UI language code from session state."""
-    return st.session_state.get("ui_language", DEFAULT_LANGUAGE)
+    lang = getattr(_RUN, "lang", None)
+    if lang is None:
+        lang = _RUN.lang = st.session_state.get("ui_language", DEFAULT_LANGUAGE)
+    return lang
 
 
 _STRINGS = {
@@ -64,10 +81,12 @@ _STRINGS = {
         "select_before_save": "Seleccione una etiqueta antes de guardar.",
         "label_saved": "✅ Etiqueta guardada en la base de datos.",
         "save_error": "Error al guardar",
+        "audit_save_retry": "⚠️ No se pudo guardar en la base de datos; se reintentará: {error}",
         # Recorder
         "dictation": "🎙️ Dictado y Transcripción",
         "record_audio": "Grabar audio",
         "transcribing": "Transcribiendo audio…",
+        "transcription_error": "Error de transcripción: {error}",
         "transcription_editable": "Transcripción (editable)",
         "transcription_placeholder": "Grabe un audio o escriba la transcripción manualmente…",
         "segments_timestamps": "🕐 Segmentos con timestamps",
@@ -124,7 +143,9 @@ _STRINGS = {
         "session_info": "📊 Información de sesión",
         "bulk_download": "📦 Descargar todo el etiquetado",
         "download_all_zip": "⬇️ Descargar todo el etiquetado (ZIP)",
+        "preparing_zip": "Preparando el paquete ZIP…",
         "download_file": "⬇️ Descargar — {filename}",
+        "prepare_download": "📦 Preparar descarga — {filename}",
         "incomplete_fields_msg": "La imagen **{filename}** tiene campos sin completar:",
         "missing_categorical": "Etiqueta categórica",
         "missing_locs": "LOCS III – {field}",
@@ -136,11 +157,16 @@ _STRINGS = {
         "col_categorical": "Categórica",
         "col_locs": "LOCS III",
         "col_voice": "Voz",
+        "col_date": "Fecha",
+        "col_times": "Veces",
+        "col_relabel": "Re-etiquetar",
         "locs_not_required": "No Necesario",
+        "show_all": "Mostrar todas ({count})",
         "image_counter": "{current} de {total}",
         # Gallery
         "gallery_prev": "◀ Ant.",
         "gallery_next": "Sig. ▶",
+        "select_image": "Seleccionar imagen",
         # Uploader
         "relabel_dialog_msg": "**{count} imagen(es)** ya fueron etiquetadas anteriormente. Seleccione cuáles desea volver a etiquetar.",
         "relabel_new_info": "ℹ️ Las otras **{count}** imagen(es) nuevas se subirán automáticamente.",
@@ -200,9 +226,11 @@ _STRINGS = {
         "select_before_save": "Select a label before saving.",
         "label_saved": "✅ Label saved to database.",
         "save_error": "Save error",
+        "audit_save_retry": "⚠️ Could not save to the database; will retry: {error}",
         "dictation": "🎙️ Dictation & Transcription",
         "record_audio": "Record audio",
         "transcribing": "Transcribing audio…",
+        "transcription_error": "Transcription error: {error}",
         "transcription_editable": "Transcription (editable)",
         "transcription_placeholder": "Record audio or type the transcription manually…",
         "segments_timestamps": "🕐 Segments with timestamps",
@@ -250,7 +278,9 @@ _STRINGS = {
         "session_info": "📊 Session Information",
         "bulk_download": "📦 Download All Labeling",
         "download_all_zip": "⬇️ Download all labeling (ZIP)",
+        "preparing_zip": "Preparing the ZIP package…",
         "download_file": "⬇️ Download — {filename}",
+        "prepare_download": "📦 Prepare download — {filename}",
         "incomplete_fields_msg": "Image **{filename}** has incomplete fields:",
         "missing_categorical": "Categorical label",
         "missing_locs": "LOCS III – {field}",
@@ -262,10 +292,15 @@ _STRINGS = {
         "col_categorical": "Categorical",
         "col_locs": "LOCS III",
         "col_voice": "Voice",
+        "col_date": "Date",
+        "col_times": "Times",
+        "col_relabel": "Re-label",
         "locs_not_required": "Not Required",
+        "show_all": "Show all ({count})",
         "image_counter": "{current} of {total}",
         "gallery_prev": "◀ Prev",
         "gallery_next": "Next ▶",
+        "select_image": "Select image",
         "relabel_dialog_msg": "**{count} image(s)** were previously labeled. Select which ones to re-label.",
         "relabel_new_info": "ℹ️ The other **{count}** new image(s) will be uploaded automatically.",
         "accept_upload": "✅ Accept and upload",
@@ -282,10 +317,30 @@ _STRINGS = {
 }
 
 
+# One hash probe per lookup instead of a dict-of-dicts walk.  Static texts
+# are interned so the copies rendered on every run share one object;
+# templates are left alone since t() formats them into new strings anyway.
+_FLAT: dict[tuple[str, str], str] = {
+    (lang, key): text if "{" in text else sys.intern(text)
+    for lang, strings in _STRINGS.items()
+    for key, text in strings.items()
+}
+
+def _template(lang: str, key: str) -> str:
+    """The raw text for *key*, falling back to the default language."""
+    text = _FLAT.get((lang, key))
+    if text is None:
+        text = _FLAT.get((DEFAULT_LANGUAGE, key), key)
+    return text
+
+
 def t(key: str, **kwargs) -> str:
-    """Return the translated string for *key*, with optional format kwargs."""
-    lang = _get_lang()
-    text = _STRINGS.get(lang, _STRINGS["es"]).get(key, key)
+    """Return the translated string for *key*, with optional format kwargs.
+
+    Only the template lookup is shared; formatted strings can carry patient
+    filenames, so they are built per call and never cached.
+    """
+    text = _template(_get_lang(), key)
     if kwargs:
         try:
             text = text.format(**kwargs)
@@ -314,18 +369,27 @@ _LABEL_DISPLAY = {
 }
 
 
+_LABEL_FLAT: dict[tuple[str, str], str] = {
+    (lang, name): text
+    for lang, names in _LABEL_DISPLAY.items()
+    for name, text in names.items()
+}
+
+
 def label_display(english_name: str) -> str:
     """Translate a label's English display name to the active UI language."""
-    lang = _get_lang()
-    return _LABEL_DISPLAY.get(lang, _LABEL_DISPLAY["en"]).get(english_name, english_name)
+    return _LABEL_FLAT.get((_get_lang(), english_name), english_name)
+
+
+_LABEL_REVERSE = {
+    lang: {text: name for name, text in names.items()}
+    for lang, names in _LABEL_DISPLAY.items()
+}
 
 
 def label_from_display(translated_name: str) -> str | None:
     """Reverse-map a translated label back to its English storage name."""
-    lang = _get_lang()
-    mapping = _LABEL_DISPLAY.get(lang, _LABEL_DISPLAY["en"])
-    reverse = {v: k for k, v in mapping.items()}
-    return reverse.get(translated_name)
+    return _LABEL_REVERSE.get(_get_lang(), _LABEL_REVERSE["en"]).get(translated_name)
 
 
 # ── LOCS display translations ────────────────────────────────────────────────
@@ -359,9 +423,16 @@ _LOCS_DISPLAY = {
 }
 
 
+_LOCS_FLAT: dict[tuple[str, str], str] = {
+    (lang, eng): text
+    for lang, names in _LOCS_DISPLAY.items()
+    for eng, text in names.items()
+}
+
+
 def locs_display(english_text: str) -> str:
     """Translate a LOCS field label or option to the active UI language."""
     lang = _get_lang()
     if lang == "en":
         return english_text
-    return _LOCS_DISPLAY.get(lang, {}).get(english_text, english_text)
+    return _LOCS_FLAT.get((lang, english_text), english_text)
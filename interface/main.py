@@ -2,22 +2,27 @@ import os
 # CRITICAL FIX: MUST BE THE FIRST LINE
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
+import html
 import streamlit as st
-import math
 import config
 import database as db
 import utils
-from i18n import t, label_display, SUPPORTED_LANGUAGES, DEFAULT_LANGUAGE
+from i18n import (
+    t, label_display, reset_run_cache,
+    SUPPORTED_LANGUAGES, LANGUAGE_CODES, DEFAULT_LANGUAGE,
+)
 from services import session_manager as sm
-from services.whisper_service import load_whisper_model
 from components.uploader import render_uploader
 from components.gallery import render_gallery
 from components.labeler import render_labeler
-from components.recorder import render_recorder
 from components.downloader import render_downloader
 from components.image_protection import inject_image_protection
+from components.layout import inject_layout_fix
 from services.auth_service import require_auth, do_logout
 
+# New run: the UI language may have changed since the last one
+reset_run_cache()
+
 # ── PAGE CONFIG ──────────────────────────────────────────────────────────────
 st.set_page_config(
     page_title=config.APP_TITLE,
@@ -26,37 +31,7 @@ st.set_page_config(
 )
 
 # ── FIX: Prevent horizontal layout shift from scrollbar appearing/disappearing
-# HF Spaces renders Streamlit inside an iframe. The scroll container is NOT
-# <html> but internal Streamlit elements. We target every possible scroll
-# container and use scrollbar-gutter:stable (modern) + overflow-y:scroll (fallback).
-st.markdown("""
-<style>
-    /* Modern solution: reserves space for scrollbar even when not needed */
-    html,
-    body,
-    [data-testid="stAppViewContainer"],
-    [data-testid="stMain"],
-    .main,
-    section[data-testid="stMain"],
-    [data-testid="stVerticalBlockBorderWrapper"],
-    .stMainBlockContainer {
-        scrollbar-gutter: stable !important;
-    }
-
-    /* Fallback: force scrollbar always visible on all potential containers */
-    [data-testid="stAppViewContainer"],
-    [data-testid="stMain"],
-    section.main {
-        overflow-y: scroll !important;
-    }
-
-    /* Prevent any horizontal overflow that could cause shifts */
-    [data-testid="stMainBlockContainer"],
-    [data-testid="stVerticalBlock"] {
-        overflow-x: hidden !important;
-    }
-</style>
-""", unsafe_allow_html=True)
+inject_layout_fix()
 
 # ── IMAGE PROTECTION (prevent download / right-click save) ───────────────────
 inject_image_protection()
@@ -65,6 +40,11 @@ inject_image_protection()
 if not require_auth():
     st.stop()
 
+# Whisper pulls in torch: import it only once a user is past the login form,
+# so the login page of a fresh process renders without waiting for it
+from services.whisper_service import load_whisper_model
+from components.recorder import render_recorder
+
 # ── UI LANGUAGE (initialize before anything renders) ─────────────────────────
 if "ui_language" not in st.session_state:
     st.session_state.ui_language = DEFAULT_LANGUAGE
@@ -87,62 +67,215 @@ if sm.check_session_timeout(config.SESSION_TIMEOUT_MINUTES):
     sm.init_session()
 
 # ── DATABASE (metadata only — never images or audio) ────────────────────────
-utils.setup_env()
+# Environment and DB setup are process-wide: run them once, not per rerun.
+# A failed init raises and is not cached, so the next rerun retries it.
+@st.cache_resource(show_spinner=False)
+def _bootstrap() -> str:
+    utils.setup_env()
+    return db.init_db()
+
+
 try:
-    active_db_type = db.init_db()
+    active_db_type = _bootstrap()
 except Exception as e:
     st.error(t("db_error", error=str(e)))
     st.stop()
 
+
+# Audit writes are queued by the components and flushed at the end of the
+# run (the labeler fragment flushes its own).  Flushing here as well picks
+# up writes a st.rerun()/st.stop() cut off last run; no-op when empty.
+sm.flush_annotation_saves()
+
+
+HISTORY_PREVIEW_CHARS = 60
+_CENTERED_HTML = "<div style='text-align:center'>{}</div>"
+
+
+# Most reruns (typing, paging back) ask for a history page that hasn't
+# changed.  The version key drops cached pages after every local write;
+# the TTL bounds staleness from other app instances sharing the DB.
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def _history_grouped_cached(version: int, search: str, page: int, per_page: int, after):
+    groups, total, next_cursor = db.get_history_grouped(search, page, per_page, after)
+    # Records never change once fetched: derive the display strings here,
+    # once per cached page, instead of in the sidebar loop on every rerun
+    for group in groups:
+        for ann in group["annotations"]:
+            text = ann.get("transcription") or ""
+            ann["_ts"] = str(ann.get("createdAt", ""))[:16]
+            ann["_preview"] = (
+                text[:HISTORY_PREVIEW_CHARS] + "…"
+                if len(text) > HISTORY_PREVIEW_CHARS else text
+            )
+    return groups, total, next_cursor
+
+
+_CAPTION_HTML = "<p style='opacity:0.6;font-size:0.875rem;margin:0'>{}</p>"
+
+
+def _render_history_group(annotations: list[dict]) -> str:
+    """Return the body of one history expander as a single HTML block.
+
+    One st.markdown per group instead of four or five elements per
+    annotation.  Everything coming from the DB is escaped.
+    """
+    multiple = len(annotations) > 1
+    label_header = html.escape(t("label_header"))
+    doctor_header = html.escape(t("doctor_header"))
+    no_transcription = _CAPTION_HTML.format(f"<i>{html.escape(t('no_transcription'))}</i>")
+    parts = []
+    for i, ann in enumerate(annotations):
+        if i:
+            parts.append("<hr style='margin:0.75rem 0'>")
+        if multiple:
+            parts.append(f"<p><b>#{i + 1}</b> — <code>{html.escape(ann['_ts'])}</code></p>")
+        label = ann.get("label")
+        parts.append(
+            f"<p style='margin:0'><b>{label_header}:</b> "
+            f"{html.escape(label_display(label)) if label else '—'}</p>"
+            f"<p><b>{doctor_header}:</b> {html.escape(ann.get('doctorName') or '—')}</p>"
+        )
+        preview = ann["_preview"]
+        parts.append(
+            _CAPTION_HTML.format(f"📝 {html.escape(preview)}") if preview else no_transcription
+        )
+    return f"<div>{''.join(parts)}</div>"
+
+
+_DETAILS_HTML = (
+    "<details style='border:1px solid rgba(128,128,128,0.3);border-radius:0.5rem;"
+    "padding:0.5rem 0.75rem;margin-bottom:0.5rem'>"
+    "<summary style='cursor:pointer'>{}</summary>{}</details>"
+)
+
+
+def _render_history_page(groups: list[dict]) -> str:
+    """Return a whole history page as collapsible <details> blocks.
+
+    One st.markdown for the page instead of an st.expander per group.
+    """
+    parts = []
+    for group in groups:
+        annotations = group["annotations"]
+        n_annotations = len(annotations)
+        latest_label = annotations[0].get("label") or "—"
+        # Badge showing number of labelings
+        badge = f" ({n_annotations}x)" if n_annotations > 1 else ""
+        summary = html.escape(f"📄 {group['imageFilename']}{badge} — {latest_label}")
+        parts.append(_DETAILS_HTML.format(summary, _render_history_group(annotations)))
+    return "".join(parts)
+
+
 # ── SIDEBAR ──────────────────────────────────────────────────────────────────
+# Widget callbacks run before the next script run, so no extra st.rerun()
+def _on_ui_language_change():
+    st.session_state.ui_language = st.session_state._ui_language_selector
+
+
+def _on_history_search_change():
+    st.session_state.history_page = 1
+    st.session_state.history_cursors = {}
+
+
+def _on_history_page_step(step: int):
+    st.session_state.history_page += step
+
+
+# Searching and paging only rerun this fragment, not the whole page
+# (uploader, gallery, labeler, recorder).
+@st.fragment
+def _render_history():
+    st.subheader(t("history"))
+    # Bound to session state by key; a new search restarts at page 1
+    st.text_input(
+        t("search_image"),
+        key="history_search",
+        on_change=_on_history_search_change,
+    )
+
+    st.session_state.setdefault("history_page", 1)
+    # {page: keyset cursor} — filled as pages are visited, so paging forward
+    # or back resumes from a known boundary instead of an OFFSET.  A save
+    # (from any session) reorders the groups and moves those boundaries:
+    # drop them and let the current page fall back to OFFSET paging.
+    version = db.data_version()
+    if st.session_state.get("history_cursors_version") != version:
+        st.session_state.history_cursors_version = version
+        st.session_state.history_cursors = {}
+    cursors = st.session_state.history_cursors
+
+    ITEMS_PER_PAGE = 5
+    try:
+        history_groups, total_items, next_cursor = _history_grouped_cached(
+            version,
+            st.session_state.get("history_search", ""),
+            st.session_state.history_page,
+            ITEMS_PER_PAGE,
+            cursors.get(st.session_state.history_page),
+        )
+        cursors[st.session_state.history_page + 1] = next_cursor
+    except Exception as e:
+        st.error(t("history_error", error=str(e)))
+        history_groups, total_items = [], 0
+
+    if not history_groups:
+        st.caption(t("no_records"))
+    else:
+        st.markdown(_render_history_page(history_groups), unsafe_allow_html=True)
+
+    total_pages = utils.page_count(total_items, ITEMS_PER_PAGE)
+    if total_pages > 1:
+        c1, c2, c3 = st.columns([1, 2, 1])
+        with c1:
+            if st.session_state.history_page > 1:
+                st.button("◀️", on_click=_on_history_page_step, args=(-1,))
+        with c2:
+            st.markdown(
+                _CENTERED_HTML.format(f"{st.session_state.history_page} / {total_pages}"),
+                unsafe_allow_html=True,
+            )
+        with c3:
+            if st.session_state.history_page < total_pages:
+                st.button("▶️", on_click=_on_history_page_step, args=(1,))
+
+
 with st.sidebar:
     st.title(t("settings"))
 
-    # Language selector
-    lang_codes = list(SUPPORTED_LANGUAGES.keys())
-    lang_names = list(SUPPORTED_LANGUAGES.values())
-    current_lang_idx = lang_codes.index(st.session_state.ui_language) if st.session_state.ui_language in lang_codes else 0
-    selected_ui_lang = st.selectbox(
+    # Language selector (options are the static codes; names via format_func).
+    # The callback runs before the rerun, so the whole page — including what
+    # renders above this widget — already uses the new language.
+    current_lang_idx = LANGUAGE_CODES.index(st.session_state.ui_language) if st.session_state.ui_language in LANGUAGE_CODES else 0
+    st.selectbox(
         t("ui_language"),
-        lang_names,
+        LANGUAGE_CODES,
         index=current_lang_idx,
+        format_func=SUPPORTED_LANGUAGES.get,
         key="_ui_language_selector",
+        on_change=_on_ui_language_change,
     )
-    new_lang_code = lang_codes[lang_names.index(selected_ui_lang)]
-    if new_lang_code != st.session_state.ui_language:
-        st.session_state.ui_language = new_lang_code
-        st.rerun()
 
     st.divider()
 
-    # Doctor name
-    doctor = st.text_input(
-        t("doctor_name"),
-        value=st.session_state.get("doctor_name", ""),
-    )
-    if doctor != st.session_state.get("doctor_name", ""):
-        st.session_state.doctor_name = doctor
+    # Doctor name (the widget reads and writes session_state.doctor_name)
+    st.text_input(t("doctor_name"), key="doctor_name")
 
     st.divider()
 
     # Whisper language (select FIRST so models can be filtered)
-    lang_keys = list(config.WHISPER_LANGUAGE_OPTIONS.keys())
-    lang_labels = list(config.WHISPER_LANGUAGE_OPTIONS.values())
-    selected_lang_display = st.selectbox(t("dictation_language"), lang_labels, index=0)
-    selected_language = lang_keys[lang_labels.index(selected_lang_display)]
-
-    # Whisper model — filtered by selected language
-    # Models ending in ".en" → English only.  Others → multilingual.
-    # "large" and "turbo" are multilingual and work for all languages.
+    selected_language = st.selectbox(
+        t("dictation_language"),
+        config.WHISPER_LANGUAGE_CODES,
+        index=0,
+        format_func=config.WHISPER_LANGUAGE_OPTIONS.get,
+    )
+
+    # Whisper model — filtered by selected language (lists built in config)
     if selected_language == "en":
-        available_models = [
-            m for m in config.WHISPER_MODEL_OPTIONS
-            if m.endswith(".en") or m in ("large", "turbo")
-        ]
+        available_models = config.WHISPER_MODELS_EN
     else:
-        available_models = [
-            m for m in config.WHISPER_MODEL_OPTIONS if not m.endswith(".en")
-        ]
+        available_models = config.WHISPER_MODELS_MULTILINGUAL
     selected_model = st.selectbox(
         t("whisper_model"),
         available_models,
@@ -165,84 +298,7 @@ with st.sidebar:
     st.divider()
 
     # ── Annotation History (from DB) — Grouped by image ────────────────────────
-    st.subheader(t("history"))
-    search_input = st.text_input(
-        t("search_image"),
-        value=st.session_state.get("history_search", ""),
-    )
-    if search_input != st.session_state.get("history_search", ""):
-        st.session_state.history_search = search_input
-        st.session_state.history_page = 1
-        st.rerun()
-
-    if "history_page" not in st.session_state:
-        st.session_state.history_page = 1
-
-    ITEMS_PER_PAGE = 5
-    try:
-        history_groups, total_items = db.get_history_grouped(
-            st.session_state.get("history_search", ""),
-            st.session_state.history_page,
-            ITEMS_PER_PAGE,
-        )
-    except Exception as e:
-        st.error(t("history_error", error=str(e)))
-        history_groups, total_items = [], 0
-
-    if not history_groups:
-        st.caption(t("no_records"))
-    else:
-        for group in history_groups:
-            fname = group["imageFilename"]
-            annotations = group["annotations"]
-            n_annotations = len(annotations)
-            latest = annotations[0]
-            latest_label = latest.get("label") or "—"
-
-            # Badge showing number of labelings
-            badge = f" ({n_annotations}x)" if n_annotations > 1 else ""
-
-            with st.expander(f"📄 {fname}{badge} — {latest_label}"):
-                for i, ann in enumerate(annotations):
-                    ts = str(ann.get("createdAt", ""))[:16]
-                    label = ann.get("label") or "—"
-                    doctor = ann.get("doctorName") or "—"
-                    text = ann.get("transcription", "") or ""
-                    preview = (text[:60] + "…") if len(text) > 60 else text
-
-                    if n_annotations > 1:
-                        st.markdown(
-                            f"**#{i + 1}** — `{ts}`"
-                        )
-                    st.write(f"**{t('label_header')}:** {label_display(label) if label != '—' else label}")
-                    st.write(f"**{t('doctor_header')}:** {doctor}")
-                    if preview:
-                        st.caption(f"📝 {preview}")
-                    else:
-                        st.caption(f"_{t('no_transcription')}_")
-
-                    if i < n_annotations - 1:
-                        st.divider()
-
-    total_pages = max(1, math.ceil(total_items / ITEMS_PER_PAGE))
-    if total_pages > 1:
-        c1, c2, c3 = st.columns([1, 2, 1])
-        with c1:
-            if st.session_state.history_page > 1:
-                if st.button("◀️"):
-                    st.session_state.history_page -= 1
-                    st.rerun()
-        with c2:
-            st.markdown(
-                f"<div style='text-align:center'>"
-                f"{st.session_state.history_page} / {total_pages}</div>",
-                unsafe_allow_html=True,
-            )
-        with c3:
-            if st.session_state.history_page < total_pages:
-                if st.button("▶️"):
-                    st.session_state.history_page += 1
-                    st.rerun()
+    _render_history()
 
     st.divider()
 
@@ -280,8 +336,14 @@ with st.sidebar:
                 st.rerun()
 
 # ── LOAD WHISPER MODEL ───────────────────────────────────────────────────────
-with st.spinner(t("loading_whisper", model=selected_model)):
+# The spinner is only worth rendering when the model may actually load;
+# once this session has it, load_whisper_model is a cache_resource hit.
+if st.session_state.get("_last_whisper_model") == selected_model:
     model = load_whisper_model(selected_model)
+else:
+    with st.spinner(t("loading_whisper", model=selected_model)):
+        model = load_whisper_model(selected_model)
+    st.session_state._last_whisper_model = selected_model
 
 # ── MAIN CONTENT ─────────────────────────────────────────────────────────────
 st.title(f"{config.APP_ICON} {config.APP_TITLE}")
@@ -312,7 +374,7 @@ if current_id is None or current_id not in st.session_state.images:
 
 current_img = sm.get_current_image()
 order = st.session_state.image_order
-current_idx = order.index(current_id)
+current_idx = sm.index_of(current_id)
 
 # ── Single-column layout ─────────────────────────────────────────────────────
 
@@ -339,8 +401,10 @@ with c1:
         st.rerun()
 with c2:
     st.markdown(
-        f"<div style='text-align:center'><b>{current_img['filename']}</b>"
-        f"<br>({t('image_counter', current=current_idx + 1, total=len(order))})</div>",
+        _CENTERED_HTML.format(
+            f"<b>{current_img['filename']}</b>"
+            f"<br>({t('image_counter', current=current_idx + 1, total=len(order))})"
+        ),
         unsafe_allow_html=True,
     )
 with c3:
@@ -358,9 +422,12 @@ if st.button(t("delete_image"), key="delete_img"):
 st.divider()
 
 # 3️⃣ RECORDER — dictation and transcription
-render_recorder(current_id, model, selected_language)
+render_recorder(current_id, model, selected_language, selected_model)
 
 st.divider()
 
 # 4️⃣ DOWNLOAD (individual) + SESSION INFO — two columns
 render_downloader(current_id)
+
+# Queued audit writes from this run (e.g. a finished transcription)
+sm.flush_annotation_saves()
@@ -10,12 +10,36 @@ import csv
 import json
 import zipfile
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+import config
+from services import session_manager as sm
 
+# orjson is optional — a much faster encoder for the metadata sidecars
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
-def _sanitize(name: str) -> str:
-    """Remove characters not safe for ZIP entry names."""
-    return "".join(c if c.isalnum() or c in "._- " else "_" for c in name)
+# Only the small text sidecars (JSON/CSV/TXT) are deflated — WAV entries
+# are stored as-is.  Text compresses well even at level 1; higher levels
+# mostly burn CPU on the bulk export for a marginally smaller archive.
+_ZIP_LEVEL = 1
+
+
+def _dumps_pretty(obj) -> bytes:
+    """UTF-8 JSON with a 2-space indent (what the .json sidecars use)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _dumps_line(obj) -> bytes:
+    """Compact UTF-8 JSON for one JSONL line."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
 
 
 def _image_metadata(img: dict) -> dict:
@@ -32,111 +56,224 @@ def _image_metadata(img: dict) -> dict:
     }
 
 
+def _metadata_json(img: dict, meta: dict) -> bytes:
+    """Serialized metadata.json for *img*, memoized on the image dict.
+
+    Comparing the dicts is far cheaper than re-serializing, so an image
+    whose metadata did not change since the last export reuses its bytes.
+    """
+    cached = img.get("_meta_json")
+    if cached is not None and cached[0] == meta:
+        return cached[1]
+    data = _dumps_pretty(meta)
+    # locs_data is the image's live dict (edited in place): keep a copy
+    img["_meta_json"] = (dict(meta, locs_data=dict(meta["locs_data"])), data)
+    return data
+
+
+# ── Export cache ─────────────────────────────────────────────────────────────
+# Streamlit reruns the whole script on every click, so the download buttons
+# would rebuild every package each time.  Results are memoized in the session
+# (never in a process-wide cache) and invalidated by a cheap fingerprint.
+
+def _session_fingerprint() -> int:
+    """Hash everything in the session that affects the exported packages."""
+    images = st.session_state.images
+    parts = []
+    for img_id in st.session_state.image_order:
+        img = images[img_id]
+        parts.append((
+            img_id,
+            img["label"],
+            tuple(sorted(img.get("locs_data", {}).items())),
+            img["transcription"],
+            img["transcription_original"],
+            img.get("labeled_by", ""),
+            img.get("audio_fingerprint"),
+        ))
+    return hash(tuple(parts))
+
+
+# Timestamped download names, rebuilt on every call so a cached package is
+# still offered under the time it is downloaded.
+_FILE_NAMES = {
+    "export_full_session": ("sesion_{}.zip", "%Y-%m-%d_%H%M"),
+    "export_huggingface_csv": ("dataset_hf_{}.csv", "%Y%m%d_%H%M"),
+    "export_jsonl": ("dataset_{}.jsonl", "%Y%m%d_%H%M"),
+}
+
+
+def _download_name(exporter_name: str, default: str = "") -> str:
+    """Current suggested filename for *exporter_name*'s package."""
+    spec = _FILE_NAMES.get(exporter_name)
+    if spec is None:
+        return default
+    template, fmt = spec
+    return template.format(datetime.datetime.now().strftime(fmt))
+
+
+def cached_export(exporter) -> tuple[bytes, str]:
+    """Return ``exporter()``, reusing the last payload while nothing changed."""
+    fingerprint = _session_fingerprint()
+    cache = st.session_state.setdefault("_export_cache", {})
+    hit = cache.get(exporter.__name__)
+    if hit is None or hit[0] != fingerprint:
+        hit = (fingerprint, *exporter())
+        cache[exporter.__name__] = hit
+    return hit[1], _download_name(exporter.__name__, hit[2])
+
+
 # ── Individual export ────────────────────────────────────────────────────────
 
 def export_single_image(image_id: str) -> tuple[bytes, str]:
     """Create a ZIP for one image's labeling data.
 
-    Returns (zip_bytes, suggested_filename).
+    Returns (zip_bytes, suggested_filename).  The archive is copied out of
+    its buffer once, here: st.download_button would call getvalue() on a
+    BytesIO every time it renders, while a (cached) bytes object is sent
+    as-is.
     """
     img = st.session_state.images[image_id]
-    safe_name = _sanitize(img["filename"].rsplit(".", 1)[0])
-    folder = f"etiquetado_{safe_name}"
+    folder = f"etiquetado_{img['safe_stem']}"
 
     buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED,
+                         compresslevel=_ZIP_LEVEL) as zf:
         # metadata.json
         meta = _image_metadata(img)
-        zf.writestr(f"{folder}/metadata.json", json.dumps(meta, ensure_ascii=False, indent=2))
+        zf.writestr(f"{folder}/metadata.json", _metadata_json(img, meta))
 
         # transcripcion.txt
         zf.writestr(f"{folder}/transcripcion.txt", img["transcription"] or "")
 
-        # audio_dictado.wav (if recorded)
+        # audio_dictado.wav (if recorded) — stored, not deflated: PCM audio
+        # barely shrinks and dominates the archive's compression time.
         if img["audio_bytes"]:
-            zf.writestr(f"{folder}/audio_dictado.wav", img["audio_bytes"])
+            zf.writestr(f"{folder}/audio_dictado.wav", img["audio_bytes"],
+                        compress_type=zipfile.ZIP_STORED)
 
-    zip_bytes = buf.getvalue()
-    return zip_bytes, f"{folder}.zip"
+    return buf.getvalue(), f"{folder}.zip"
 
 
 # ── Bulk export (full session) ───────────────────────────────────────────────
 
-def export_full_session() -> tuple[bytes, str]:
+def export_full_session(images: dict | None = None,
+                        order: list | None = None) -> tuple[bytes, str]:
     """Create a ZIP with all images' labeling data + a summary CSV.
 
-    Returns (zip_bytes, suggested_filename).
+    *images* / *order* default to the live session; the background prebuild
+    passes a snapshot instead because worker threads cannot read
+    st.session_state.
+
+    Returns (zip_bytes, suggested_filename) — see export_single_image.
     """
     now = datetime.datetime.now().strftime("%Y-%m-%d_%H%M")
     root = f"sesion_{now}"
-    images = st.session_state.images
-    order = st.session_state.image_order
+    if images is None:
+        images = st.session_state.images
+        order = st.session_state.image_order
 
     buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        # ── Summary CSV ──────────────────────────────────────────────────
-        csv_buf = io.StringIO()
-        writer = csv.writer(csv_buf)
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED,
+                         compresslevel=_ZIP_LEVEL) as zf:
+        # One pass over the images: each one's metadata is built and
+        # serialized once, and feeds the CSV, etiquetas.json and its folder.
+        # CSV rows are encoded as they are written (no str copy of the CSV).
+        csv_buf = io.BytesIO()
+        csv_text = io.TextIOWrapper(csv_buf, encoding="utf-8", newline="")
+        writer = csv.writer(csv_text)
         writer.writerow(["filename", "label", "nuclear_opalescence",
                          "nuclear_color", "cortical_opacity",
                          "has_audio", "has_transcription", "doctor"])
-        for img_id in order:
+        all_meta = []
+        for idx, img_id in enumerate(order, start=1):
             img = images[img_id]
-            locs = img.get("locs_data", {})
+            meta = _image_metadata(img)
+            locs = meta["locs_data"]
+            all_meta.append(meta)
+
+            # ── Summary CSV row ──────────────────────────────────────────
             writer.writerow([
-                img["filename"],
-                img["label"] or "",
+                meta["filename"],
+                meta["label"] or "",
                 locs.get("nuclear_opalescence", ""),
                 locs.get("nuclear_color", ""),
                 locs.get("cortical_opacity", ""),
                 "yes" if img["audio_bytes"] else "no",
-                "yes" if img["transcription"] else "no",
-                img.get("labeled_by", ""),
+                "yes" if meta["transcription"] else "no",
+                meta["doctor"],
             ])
-        zf.writestr(f"{root}/resumen.csv", csv_buf.getvalue())
 
+            # ── Per-image folder ─────────────────────────────────────────
+            img_folder = f"{root}/{idx:03d}_{img['safe_stem']}"
+            zf.writestr(f"{img_folder}/metadata.json", _metadata_json(img, meta))
+            zf.writestr(f"{img_folder}/transcripcion.txt", img["transcription"] or "")
+
+            if img["audio_bytes"]:
+                zf.writestr(f"{img_folder}/audio_dictado.wav", img["audio_bytes"],
+                            compress_type=zipfile.ZIP_STORED)
+
+        csv_text.detach()  # flush; csv_buf stays open
+        zf.writestr(f"{root}/resumen.csv", csv_buf.getbuffer())
         # ── Full metadata JSON ───────────────────────────────────────────
-        all_meta = []
-        for img_id in order:
-            all_meta.append(_image_metadata(images[img_id]))
         zf.writestr(
             f"{root}/etiquetas.json",
-            json.dumps(all_meta, ensure_ascii=False, indent=2),
+            _dumps_pretty(all_meta),
         )
 
-        # ── Per-image folders ────────────────────────────────────────────
-        for idx, img_id in enumerate(order, start=1):
-            img = images[img_id]
-            safe_name = _sanitize(img["filename"].rsplit(".", 1)[0])
-            img_folder = f"{root}/{idx:03d}_{safe_name}"
+    return buf.getvalue(), f"{root}.zip"
 
-            meta = _image_metadata(img)
-            zf.writestr(f"{img_folder}/metadata.json", json.dumps(meta, ensure_ascii=False, indent=2))
-            zf.writestr(f"{img_folder}/transcripcion.txt", img["transcription"] or "")
 
-            if img["audio_bytes"]:
-                zf.writestr(f"{img_folder}/audio_dictado.wav", img["audio_bytes"])
+# ── Background prebuild of the full-session ZIP ─────────────────────────────
+# Once every image is complete the doctor is about to download, so the ZIP is
+# built off the UI path.  A single worker keeps prebuilds from competing with
+# each other; a newer request cancels one that has not started yet.
+_PREBUILD_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="zip-prebuild")
 
-    zip_bytes = buf.getvalue()
-    return zip_bytes, f"{root}.zip"
+
+def schedule_full_session_prebuild():
+    """Start building the full-session ZIP in a background thread."""
+    fingerprint = _session_fingerprint()
+    pending = st.session_state.get("_zip_prebuild")
+    if pending is not None:
+        if pending[0] == fingerprint:
+            return
+        pending[1].cancel()
+
+    # Snapshot: the worker must not see later edits to the live dicts
+    images = {
+        img_id: dict(img, locs_data=dict(img.get("locs_data", {})))
+        for img_id, img in st.session_state.images.items()
+    }
+    order = list(st.session_state.image_order)
+    future = _PREBUILD_EXECUTOR.submit(export_full_session, images, order)
+    st.session_state["_zip_prebuild"] = (fingerprint, future)
+
+
+def get_full_session_export() -> tuple[bytes, str]:
+    """Return the full-session ZIP, using a matching background prebuild."""
+    pending = st.session_state.get("_zip_prebuild")
+    if (
+        pending is not None
+        and not pending[1].cancelled()
+        and pending[0] == _session_fingerprint()
+    ):
+        try:
+            data, file_name = pending[1].result()
+            return data, _download_name("export_full_session", file_name)
+        except Exception:
+            # A failed prebuild must not break the download: build it here
+            st.session_state.pop("_zip_prebuild", None)
+    return cached_export(export_full_session)
 
 
 # ── Session summary ──────────────────────────────────────────────────────────
 
 def get_session_summary() -> dict:
     """Return a summary dict for pre-download validation."""
-    images = st.session_state.images
-    total = len(images)
-    labeled = sum(1 for img in images.values() if img["label"] is not None)
-    with_audio = sum(1 for img in images.values() if img["audio_bytes"] is not None)
-    with_text = sum(1 for img in images.values() if img["transcription"])
-    return {
-        "total": total,
-        "labeled": labeled,
-        "with_audio": with_audio,
-        "with_transcription": with_text,
-        "unlabeled": total - labeled,
-    }
+    summary = sm.get_session_data_summary()
+    summary["unlabeled"] = summary["total"] - summary["labeled"]
+    return summary
 
 
 # ── ML-ready export formats (Idea F) ────────────────────────────────────────
@@ -149,14 +286,14 @@ def export_huggingface_csv() -> tuple[bytes, str]:
 
     Returns (csv_bytes, suggested_filename).
     """
-    import config
-
     images = st.session_state.images
     order = st.session_state.image_order
-    label_map = {opt["display"]: opt["code"] for opt in config.LABEL_OPTIONS}
+    label_map = config.LABEL_CODE_BY_DISPLAY
 
-    buf = io.StringIO()
-    writer = csv.writer(buf)
+    # Rows are encoded as they are written: no str copy of the whole CSV
+    buf = io.BytesIO()
+    text = io.TextIOWrapper(buf, encoding="utf-8", newline="")
+    writer = csv.writer(text)
     writer.writerow(["filename", "label", "label_code",
                      "nuclear_opalescence", "nuclear_color", "cortical_opacity",
                      "transcription", "doctor"])
@@ -177,9 +314,24 @@ def export_huggingface_csv() -> tuple[bytes, str]:
             img.get("labeled_by", ""),
         ])
 
-    csv_bytes = buf.getvalue().encode("utf-8")
-    now = datetime.datetime.now().strftime("%Y%m%d_%H%M")
-    return csv_bytes, f"dataset_hf_{now}.csv"
+    text.detach()  # flush; buf stays open
+    csv_bytes = buf.getvalue()
+    return csv_bytes, _download_name("export_huggingface_csv")
+
+
+def _jsonl_line(img: dict) -> bytes:
+    """One serialized JSONL record for a labeled image."""
+    locs = img.get("locs_data", {})
+    return _dumps_line({
+        "filename": img["filename"],
+        "label": img["label"],
+        "label_code": config.LABEL_CODE_BY_DISPLAY.get(img["label"], ""),
+        "nuclear_opalescence": locs.get("nuclear_opalescence"),
+        "nuclear_color": locs.get("nuclear_color"),
+        "cortical_opacity": locs.get("cortical_opacity"),
+        "transcription": img["transcription"],
+        "doctor": img.get("labeled_by", ""),
+    })
 
 
 def export_jsonl() -> tuple[bytes, str]:
@@ -190,30 +342,10 @@ def export_jsonl() -> tuple[bytes, str]:
 
     Returns (jsonl_bytes, suggested_filename).
     """
-    import config
-
     images = st.session_state.images
-    order = st.session_state.image_order
-    label_map = {opt["display"]: opt["code"] for opt in config.LABEL_OPTIONS}
-
-    lines = []
-    for img_id in order:
-        img = images[img_id]
-        if img["label"] is None:
-            continue
-        locs = img.get("locs_data", {})
-        obj = {
-            "filename": img["filename"],
-            "label": img["label"],
-            "label_code": label_map.get(img["label"], ""),
-            "nuclear_opalescence": locs.get("nuclear_opalescence"),
-            "nuclear_color": locs.get("nuclear_color"),
-            "cortical_opacity": locs.get("cortical_opacity"),
-            "transcription": img["transcription"],
-            "doctor": img.get("labeled_by", ""),
-        }
-        lines.append(json.dumps(obj, ensure_ascii=False))
-
-    jsonl_bytes = "\n".join(lines).encode("utf-8")
-    now = datetime.datetime.now().strftime("%Y%m%d_%H%M")
-    return jsonl_bytes, f"dataset_{now}.jsonl"
+    jsonl_bytes = b"\n".join([
+        _jsonl_line(img)
+        for img_id in st.session_state.image_order
+        if (img := images[img_id])["label"] is not None
+    ])
+    return jsonl_bytes, _download_name("export_jsonl")
@@ -9,7 +9,17 @@ explicitly downloads their labeling package.
 import streamlit as st
 import uuid
 import datetime
+import functools
 import gc
+from concurrent.futures import ThreadPoolExecutor
+import config
+import database as db
+from i18n import reset_run_cache, t
+from utils import make_thumbnail, safe_stem
+
+# Running per-session counters, kept in sync by sync_image_counters().
+_COUNTER_KEYS = ("labeled", "with_audio", "with_transcription", "incomplete")
+_NO_FLAGS = (False, False, False, False)
 
 
 def init_session():
@@ -23,40 +33,82 @@ def init_session():
         st.session_state.last_activity = datetime.datetime.now()
         st.session_state.doctor_name = ""
         st.session_state.confirm_end_session = False
+        st.session_state.counters = dict.fromkeys(_COUNTER_KEYS, 0)
+        st.session_state._image_flags = {}    # {uuid_str: flags last counted}
+        st.session_state._pending_annotation_saves = {}  # {uuid_str: upsert kwargs}
+        st.session_state._filenames = set()     # filenames of `images`, kept in sync
+        st.session_state._order_index = {}      # {uuid_str: position in image_order}
 
 
-def add_image(filename: str, image_bytes: bytes) -> str:
+def add_image(filename: str, image_bytes: bytes, thumb_bytes: bytes | None = None) -> str:
     """Add an uploaded image to the in-memory session store.
 
-    Returns the generated UUID for the image.
+    *thumb_bytes* may be passed when the gallery thumbnail was already built
+    (see add_images).  Returns the generated UUID for the image.
     """
+    if thumb_bytes is None:
+        thumb_bytes = make_thumbnail(image_bytes)
     img_id = str(uuid.uuid4())
     st.session_state.images[img_id] = {
         "filename": filename,
+        "short_name": filename if len(filename) <= 18 else filename[:15] + "…",
+        "safe_stem": safe_stem(filename),  # export folder/entry names
         "bytes": image_bytes,
+        "thumb_bytes": thumb_bytes,    # small JPEG for the gallery
         "label": None,                 # Categorical: Normal/Cataract/Bad quality/Needs dilation
         "locs_data": {},               # LOCS III: {"nuclear_opalescence": int, "nuclear_color": int, "cortical_opacity": int}
         "audio_bytes": None,           # WAV from recording (Phase 4)
+        "audio_fingerprint": None,     # content hash of audio_bytes (recorder)
         "transcription": "",           # Editable transcription text
         "transcription_original": "",  # Original Whisper output (read-only)
         "timestamp": datetime.datetime.now(),
         "labeled_by": st.session_state.get("doctor_name", ""),
     }
+    st.session_state._order_index[img_id] = len(st.session_state.image_order)
     st.session_state.image_order.append(img_id)
+    st.session_state._filenames.add(filename)
+    sync_image_counters(img_id)
     update_activity()
     return img_id
 
 
+def add_images(files: list[tuple[str, bytes]]) -> list[str]:
+    """Add several (filename, bytes) uploads, thumbnailing them in parallel.
+
+    PIL releases the GIL while decoding and resizing, so a batch upload
+    scales with the worker count.  Session state is only touched afterwards,
+    on the script thread.  Returns the generated UUIDs in input order.
+    """
+    if len(files) > 1:
+        with ThreadPoolExecutor(max_workers=min(8, len(files))) as pool:
+            thumbs = list(pool.map(make_thumbnail, (raw for _, raw in files)))
+    else:
+        thumbs = [None] * len(files)
+    return [
+        add_image(name, raw, thumb)
+        for (name, raw), thumb in zip(files, thumbs)
+    ]
+
+
 def remove_image(img_id: str):
     """Remove a single image from the session, freeing memory."""
-    if img_id in st.session_state.images:
-        # Explicitly clear heavy byte fields before deletion
-        st.session_state.images[img_id]["bytes"] = None
-        st.session_state.images[img_id]["audio_bytes"] = None
-        del st.session_state.images[img_id]
-
-    if img_id in st.session_state.image_order:
-        st.session_state.image_order.remove(img_id)
+    # Deleting the dict drops the session's references to its bytes, as in
+    # clear_session; a queued transcription would keep the audio alive.
+    img = st.session_state.images.pop(img_id, None)
+    if img is not None:
+        st.session_state._filenames.discard(img["filename"])
+    pending = st.session_state.get("_pending_transcriptions", {}).pop(img_id, None)
+    if pending is not None:
+        pending[0].cancel()
+
+    index = st.session_state._order_index.pop(img_id, None)
+    if index is not None:
+        order = st.session_state.image_order
+        del order[index]
+        # Only the images after the removed one move up
+        for pos in range(index, len(order)):
+            st.session_state._order_index[order[pos]] = pos
+    sync_image_counters(img_id)
 
     # Update current selection if the deleted image was active
     if st.session_state.current_image_id == img_id:
@@ -86,6 +138,16 @@ def set_current_image(img_id: str):
         update_activity()
 
 
+def index_of(img_id: str) -> int:
+    """Position of *img_id* in image_order, without scanning the list."""
+    return st.session_state._order_index[img_id]
+
+
+def get_existing_filenames() -> set[str]:
+    """Filenames already in the session (live set — do not mutate)."""
+    return st.session_state._filenames
+
+
 def get_image_count() -> int:
     """Total number of images in session."""
     return len(st.session_state.images)
@@ -93,12 +155,96 @@ def get_image_count() -> int:
 
 def get_labeling_progress():
     """Return (labeled_count, total_count)."""
-    total = len(st.session_state.images)
-    labeled = sum(
-        1 for img in st.session_state.images.values()
-        if img["label"] is not None
+    return st.session_state.counters["labeled"], len(st.session_state.images)
+
+
+def _image_signature(img: dict) -> tuple:
+    """Return the (label, LOCS keys, has_voice) tuple that decides completeness."""
+    return (
+        img.get("label"),
+        frozenset(img.get("locs_data", {})),
+        bool(img.get("transcription")),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _missing_for_signature(label, locs_keys: frozenset, has_voice: bool) -> tuple[str, ...]:
+    """Return the missing items for a signature, untranslated.
+
+    Items are "categorical", "voice" or a LOCS field id.  Only a handful of
+    distinct signatures exist, so most images resolve to a cache hit.
+    """
+    missing = []
+    if label is None:
+        missing.append("categorical")
+    elif label == "Cataract":
+        missing.extend(fid for fid in config.LOCS_FIELD_IDS if fid not in locs_keys)
+    if not has_voice:
+        missing.append("voice")
+    return tuple(missing)
+
+
+def get_missing_items(img: dict) -> tuple[str, ...]:
+    """Return what is still missing for one image (see _missing_for_signature)."""
+    return _missing_for_signature(*_image_signature(img))
+
+
+def is_image_incomplete(img: dict) -> bool:
+    """Return True on the first missing item, without building the list."""
+    label = img.get("label")
+    if label is None or not img.get("transcription"):
+        return True
+    if label == "Cataract":
+        locs = img.get("locs_data", {})
+        return any(fid not in locs for fid in config.LOCS_FIELD_IDS)
+    return False
+
+
+def _image_flags(img: dict) -> tuple[bool, bool, bool, bool]:
+    """Return the image's contribution to each of _COUNTER_KEYS."""
+    return (
+        img["label"] is not None,
+        img["audio_bytes"] is not None,
+        bool(img["transcription"]),
+        is_image_incomplete(img),
     )
-    return labeled, total
+
+
+def sync_image_counters(img_id: str) -> bool:
+    """Re-count one image after its label, LOCS, audio or transcription changed.
+
+    Must be called after every such mutation (and after add/remove) so the
+    session summaries stay O(1) instead of rescanning all images per rerun.
+    Returns True if any session counter changed.
+    """
+    counted = st.session_state._image_flags
+    img = st.session_state.images.get(img_id)
+    old = counted.get(img_id, _NO_FLAGS)
+    new = _image_flags(img) if img is not None else _NO_FLAGS
+    counters = st.session_state.counters
+    was_incomplete = counters["incomplete"] > 0
+    if new != old:
+        for key, before, after in zip(_COUNTER_KEYS, old, new):
+            counters[key] += after - before
+    if img is None:
+        counted.pop(img_id, None)
+    else:
+        counted[img_id] = new
+
+    # Session just became fully labeled → the bulk download is next;
+    # prebuild its ZIP.  Only on that transition: later edits would rebuild
+    # the snapshot on every keystroke (the download falls back to a fresh
+    # build if the content changed since).
+    if was_incomplete and st.session_state.images and not has_incomplete_images():
+        from services.export_service import schedule_full_session_prebuild
+        schedule_full_session_prebuild()
+
+    return new != old
+
+
+def has_incomplete_images() -> bool:
+    """Return True if any image still misses a label, LOCS field or dictation."""
+    return st.session_state.counters["incomplete"] > 0
 
 
 def has_undownloaded_data() -> bool:
@@ -120,16 +266,57 @@ def check_session_timeout(timeout_minutes: int = 30) -> bool:
     return False
 
 
+def queue_annotation_save(img: dict, img_id: str, doctor_name: str, session_id: str):
+    """Queue an audit-DB upsert for one image (write-behind).
+
+    Only the latest state per image is kept: the DB call is an upsert, so
+    intermediate edits never need to reach the database.
+    """
+    st.session_state._pending_annotation_saves[img_id] = {
+        "image_filename": img["filename"],
+        "label": img["label"],
+        "transcription": img.get("transcription", ""),
+        "doctor_name": doctor_name,
+        "session_id": session_id,
+        "locs_data": dict(img.get("locs_data", {})),
+    }
+
+
+def flush_annotation_saves():
+    """Write all queued annotation upserts to the audit DB (non-blocking)."""
+    pending = st.session_state.get("_pending_annotation_saves")
+    if not pending:
+        return
+    st.session_state._pending_annotation_saves = {}
+    try:
+        # One transaction for the whole batch
+        db.save_or_update_annotations_bulk(list(pending.values()))
+    except Exception as e:
+        # Transient (busy DB, timeout): requeue for the next flush; an
+        # image queued again meanwhile keeps its newer state
+        st.session_state._pending_annotation_saves = {
+            **pending, **st.session_state._pending_annotation_saves,
+        }
+        st.warning(t("audit_save_retry", error=e))
+
+
 def clear_session():
     """Completely wipe all session data — images, audio, everything.
 
     Called on explicit cleanup or session timeout.
     """
-    # Explicitly null out heavy byte fields to help garbage collection
-    for img in st.session_state.get("images", {}).values():
-        img["bytes"] = None
-        img["audio_bytes"] = None
+    # Queued audit writes are metadata, not session data — keep them
+    flush_annotation_saves()
+    # clear() drops the session's references to the image/audio bytes; the
+    # only ones that outlive it are queued background jobs, so cancel those
+    # that have not started (a running one lets go when it finishes).
+    prebuild = st.session_state.get("_zip_prebuild")
+    if prebuild is not None:
+        prebuild[1].cancel()
+    for future, _, _ in st.session_state.get("_pending_transcriptions", {}).values():
+        future.cancel()
     st.session_state.clear()
+    reset_run_cache()  # ui_language was cleared with the rest
     gc.collect()
 
 
@@ -145,14 +332,13 @@ def get_remaining_timeout_minutes(timeout_minutes: int = 30) -> float:
 
 def get_session_data_summary() -> dict:
     """Return a summary of what data exists in the session (for warnings)."""
-    images = st.session_state.get("images", {})
-    total = len(images)
-    labeled = sum(1 for img in images.values() if img["label"] is not None)
-    with_audio = sum(1 for img in images.values() if img["audio_bytes"] is not None)
-    with_text = sum(1 for img in images.values() if img["transcription"])
+    counters = st.session_state.get("counters")
+    if counters is None:
+        # Session already cleared (e.g. on timeout) — nothing left
+        counters = dict.fromkeys(_COUNTER_KEYS, 0)
     return {
-        "total": total,
-        "labeled": labeled,
-        "with_audio": with_audio,
-        "with_transcription": with_text,
+        "total": len(st.session_state.get("images", {})),
+        "labeled": counters["labeled"],
+        "with_audio": counters["with_audio"],
+        "with_transcription": counters["with_transcription"],
     }
@@ -1,14 +1,29 @@
 """OphthalmoCapture — Whisper Transcription Service
 
 Encapsulates all Whisper-related logic: model loading, transcription,
-and segment-level timestamps.  Temporary files are ALWAYS cleaned up.
+and segment-level timestamps.  Audio is decoded in memory; nothing is
+written to disk.
 """
 
+import io
 import os
 import shutil
-import tempfile
+import subprocess
+import threading
+import wave
+import numpy as np
 import streamlit as st
 import whisper
+from whisper.audio import SAMPLE_RATE
+
+# faster-whisper (CTranslate2) runs the same checkpoints 2-4x faster in
+# float16 on GPU / int8 on CPU; fall back to openai-whisper if missing.
+try:
+    import ctranslate2
+    from faster_whisper import WhisperModel
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    FASTER_WHISPER_AVAILABLE = False
 
 # ── Ensure ffmpeg is available ───────────────────────────────────────────────
 # If system ffmpeg is not in PATH, use the bundled one from imageio-ffmpeg.
@@ -33,36 +48,101 @@ if shutil.which("ffmpeg") is None:
         pass  # Will fail later with a clear Whisper error
 
 
-@st.cache_resource
+# Shared by all sessions.  Only the current and the previously selected
+# model stay resident; switching back and forth doesn't reload either.
+# main.py shows its own spinner on a real load.
+@st.cache_resource(show_spinner=False, max_entries=2)
 def load_whisper_model(model_size: str):
     """Load and cache a Whisper model."""
     print(f"Loading Whisper model: {model_size}...")
+    if FASTER_WHISPER_AVAILABLE:
+        if ctranslate2.get_cuda_device_count() > 0:
+            return WhisperModel(model_size, device="cuda", compute_type="float16")
+        return WhisperModel(model_size, device="cpu", compute_type="int8")
     return whisper.load_model(model_size)
 
 
-def transcribe_audio(model, audio_bytes: bytes, language: str = "es") -> str:
-    """Transcribe raw WAV bytes and return plain text.
+# Process-wide: one Whisper inference at a time.  Concurrent transcribe
+# calls from several sessions only contend for the same GPU/CPU (and can run
+# it out of memory); queueing them keeps each one's latency predictable.
+# A plain module lock: it is taken on worker threads, where Streamlit's
+# caches have no script context.
+_INFERENCE_LOCK = threading.Lock()
+
 
-    The temporary file is **always** deleted (try/finally).
+def _run_model(model, audio: np.ndarray, language: str) -> dict:
+    """Run *model* on decoded audio; returns openai-whisper's result shape.
+
+    faster-whisper yields segment objects lazily, so they are consumed
+    here, while the inference lock is held.
+    """
+    with _INFERENCE_LOCK:
+        if FASTER_WHISPER_AVAILABLE and isinstance(model, WhisperModel):
+            segments, _ = model.transcribe(audio, language=language)
+            segments = [
+                {"start": seg.start, "end": seg.end, "text": seg.text}
+                for seg in segments
+            ]
+            return {"text": "".join(seg["text"] for seg in segments), "segments": segments}
+        return model.transcribe(audio, language=language)
+
+
+def _decode_pcm_wav(audio_bytes: bytes) -> np.ndarray | None:
+    """Decode 16-bit PCM WAV already at Whisper's rate, in-process.
+
+    That is what st.audio_input records, so the common case needs no
+    ffmpeg process at all.  Returns None for anything else.
     """
-    tmp_path = None
     try:
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-            tmp.write(audio_bytes)
-            tmp_path = tmp.name
+        with wave.open(io.BytesIO(audio_bytes)) as wav:
+            if wav.getframerate() != SAMPLE_RATE or wav.getsampwidth() != 2:
+                return None
+            channels = wav.getnchannels()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    audio = np.frombuffer(frames, np.int16).astype(np.float32) / 32768.0
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1)
+    return audio
+
+
+def _decode_audio(audio_bytes: bytes) -> np.ndarray:
+    """Decode a recording to the 16 kHz mono float32 array Whisper expects.
+
+    16 kHz PCM WAV is read directly; anything else gets the same ffmpeg
+    conversion as whisper.load_audio, but the bytes go in over stdin and
+    the samples come back over stdout — the recording never touches the
+    disk.
+    """
+    audio = _decode_pcm_wav(audio_bytes)
+    if audio is not None:
+        return audio
+    cmd = [
+        "ffmpeg", "-threads", "0", "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le",
+        "-ar", str(SAMPLE_RATE), "-",
+    ]
+    try:
+        out = subprocess.run(cmd, input=audio_bytes, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to load audio: {e.stderr.decode()}") from e
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
 
-        result = model.transcribe(tmp_path, language=language)
+def transcribe_audio(model, audio_bytes: bytes, language: str = "es") -> str:
+    """Transcribe raw WAV bytes and return plain text."""
+    try:
+        audio = _decode_audio(audio_bytes)
+        result = _run_model(model, audio, language)
         return result.get("text", "").strip()
     except Exception as e:
         st.error(f"Error de transcripción: {e}")
         return ""
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.unlink(tmp_path)
 
 
 def transcribe_audio_with_timestamps(
-    model, audio_bytes: bytes, language: str = "es"
+    model, audio_bytes: bytes, language: str = "es", raise_errors: bool = False,
 ) -> tuple[str, list[dict]]:
     """Transcribe raw WAV bytes and return (plain_text, segments).
 
@@ -70,14 +150,12 @@ def transcribe_audio_with_timestamps(
         {"start": float, "end": float, "text": str}
 
     Useful for syncing transcript highlights with audio playback.
+    Pass raise_errors=True when running off the script thread, where
+    st.error cannot be shown; the caller reports the exception instead.
     """
-    tmp_path = None
     try:
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-            tmp.write(audio_bytes)
-            tmp_path = tmp.name
-
-        result = model.transcribe(tmp_path, language=language)
+        audio = _decode_audio(audio_bytes)
+        result = _run_model(model, audio, language)
         text = result.get("text", "").strip()
 
         segments = []
@@ -90,11 +168,10 @@ def transcribe_audio_with_timestamps(
 
         return text, segments
     except Exception as e:
+        if raise_errors:
+            raise
         st.error(f"Error de transcripción: {e}")
         return "", []
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.unlink(tmp_path)
 
 
 def format_timestamp(seconds: float) -> str:
@@ -1,6 +1,10 @@
 """OphthalmoCapture — Utility Functions."""
 
+import io
+import math
 import os
+import re
+from PIL import Image, ImageOps
 
 
 # Known image magic byte signatures
@@ -11,21 +15,73 @@ _IMAGE_SIGNATURES = [
     (b"MM\x00\x2a",           "TIFF (BE)"),
 ]
 
+# Bytes needed to sniff any of the signatures above (the PNG one is longest)
+IMAGE_HEADER_SIZE = max(len(sig) for sig, _ in _IMAGE_SIGNATURES)
+
+# Every signature is already unique in its first two bytes, so a single
+# dict probe picks the only candidate instead of trying each in turn.
+_SIGNATURE_BY_PREFIX = {sig[:2]: sig for sig, _ in _IMAGE_SIGNATURES}
+
+
+# \w is str.isalnum() plus "_" (which maps to itself): Unicode-aware, like a
+# per-character isalnum() check, in one C-level pass.
+_UNSAFE_CHARS = re.compile(r"[^\w.\- ]")
+
+
+# Gallery thumbnails are displayed at 120 px; 256 px keeps them sharp on
+# high-DPI screens while being a tiny fraction of the original fundus image.
+THUMBNAIL_SIZE = (256, 256)
+
 
 def setup_env():
     """Set up environment variables."""
     os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
 
+def minify_css(css: str) -> str:
+    """Strip comments and collapse whitespace in a <style> block."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};])\s*", r"\1", css).strip()
+
+
 def validate_image_bytes(data: bytes) -> bool:
     """Verify that *data* starts with a known image magic-byte header.
 
     Returns True if valid, False otherwise.  This prevents non-image files
-    from being accepted even if they have a valid extension.
+    from being accepted even if they have a valid extension.  Only the first
+    IMAGE_HEADER_SIZE bytes are inspected, so a header read is enough.
     """
     if not data or len(data) < 8:
         return False
-    for sig, _ in _IMAGE_SIGNATURES:
-        if data[: len(sig)] == sig:
-            return True
-    return False
+    sig = _SIGNATURE_BY_PREFIX.get(bytes(data[:2]))
+    return sig is not None and data.startswith(sig)
+
+
+def page_count(num_items: int, per_page: int) -> int:
+    """Number of pages needed for *num_items* (at least one)."""
+    return max(1, math.ceil(num_items / per_page))
+
+
+def safe_stem(filename: str) -> str:
+    """*filename* without its extension, made safe for ZIP entry names."""
+    return _UNSAFE_CHARS.sub("_", filename.rsplit(".", 1)[0])
+
+
+def make_thumbnail(data: bytes) -> bytes:
+    """Return a small JPEG preview of *data* for the gallery.
+
+    Falls back to the original bytes if the image cannot be decoded, so the
+    gallery still shows whatever the browser can render.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            # Upright like the original: phones and fundus cameras often
+            # store the rotation in EXIF rather than in the pixels
+            im = ImageOps.exif_transpose(im)
+            im.thumbnail(THUMBNAIL_SIZE)
+            buf = io.BytesIO()
+            im.convert("RGB").save(buf, format="JPEG", quality=78)
+        return buf.getvalue()
+    except Exception:
+        return data